@@ -18,18 +18,19 @@ Phase 2:
 
 import os
 import io
-import json
-import traceback
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+import re
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
-from contextlib import asynccontextmanager
+from xml.sax.saxutils import escape as xml_escape
+from contextlib import aclosing, asynccontextmanager
 
 from fastapi import FastAPI, Request, UploadFile, File, HTTPException, status, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import (
-    JSONResponse,
-    HTMLResponse,
+    ORJSONResponse,
     RedirectResponse,
     StreamingResponse,
     Response,
@@ -37,6 +38,7 @@ from fastapi.responses import (
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, field_validator
 from dotenv import load_dotenv
+import orjson
 
 # =====================================================
 # CONFIGURATION
@@ -65,7 +67,17 @@ MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "50000"))
 # LOGGING SETUP
 # =====================================================
 
-from logging_config import setup_logging, get_logger, request_id_var
+from logging_config import (
+    setup_logging,
+    get_logger,
+    log_with_context,
+    error_fingerprint,
+)
+
+# Import retry utilities (the Firestore chat log writer below uses them)
+from retry import (
+    with_retry, RetryExhausted, CircuitBreaker, RedisBreakerStore, Bulkhead, BulkheadFull,
+)
 
 logger = setup_logging(
     name="mogul",
@@ -77,22 +89,26 @@ def _mask(key: Optional[str]) -> str:
     """Safely mask API keys for logging."""
     if not key:
         return "None"
-    if len(key) <= 8:
-        return key[0] + "***" + key[-1]
-    return key[:4] + "..." + key[-4:]
-
-# Startup logging
-logger.info("=" * 50)
-logger.info("MOGUL AI AGENT - STARTUP")
-logger.info("=" * 50)
-logger.info(f"Environment: {ENVIRONMENT}")
-logger.info(f"BASE_DIR: {BASE_DIR}")
-logger.info(f"OPENAI_API_KEY: {'✅' if OPENAI_API_KEY else '❌ MISSING'}")
-logger.info(f"MODEL: {MODEL}")
-logger.info(f"ELEVENLABS: {'✅' if ELEVENLABS_API_KEY else '⚠️ disabled'}")
-logger.info(f"GUARDRAILS: {'✅ enabled' if ENABLE_GUARDRAILS else '⚠️ disabled'}")
-logger.info(f"MAX_CONTEXT_TOKENS: {MAX_CONTEXT_TOKENS}")
-logger.info("=" * 50)
+    return f"{key[:4]}...{key[-4:]}" if len(key) > 8 else f"{key[0]}***{key[-1]}"
+
+# Startup logging: one record, fields kept structured for JSON output
+_STARTUP_INFO = {
+    "environment": ENVIRONMENT,
+    "base_dir": str(BASE_DIR),
+    "env_file": ENV_PATH.exists(),
+    "openai_key": _mask(OPENAI_API_KEY),
+    "model": MODEL,
+    "elevenlabs": bool(ELEVENLABS_API_KEY),
+    "guardrails": ENABLE_GUARDRAILS,
+    "max_context_tokens": MAX_CONTEXT_TOKENS,
+}
+log_with_context(
+    logger,
+    logging.INFO,
+    "MOGUL AI AGENT - STARTUP " + " ".join(f"{k}={v}" for k, v in _STARTUP_INFO.items()),
+    event="startup",
+    **_STARTUP_INFO,
+)
 
 # =====================================================
 # ERROR HANDLING
@@ -113,13 +129,27 @@ class APIError(Exception):
         self.detail = detail
         super().__init__(message)
 
+def log_error(message: str, exc: Exception):
+    """
+    Log a caught exception without a traceback: type, message and a
+    fingerprint aggregators can count. Tracebacks are reserved for
+    the unhandled-exception handler.
+    """
+    log_with_context(
+        logger,
+        logging.ERROR,
+        f"{message}: {type(exc).__name__}: {exc}",
+        error_type=type(exc).__name__,
+        error_fingerprint=error_fingerprint(exc),
+    )
+
 def error_response(
     status_code: int, 
     error_code: str, 
     message: str, 
     detail: str = None,
     request_id: str = None
-) -> JSONResponse:
+) -> ORJSONResponse:
     """Create a standardized error response."""
     content = {
         "error": error_code,
@@ -129,21 +159,31 @@ def error_response(
         content["detail"] = detail
     if request_id:
         content["request_id"] = request_id
-    return JSONResponse(status_code=status_code, content=content)
+    return ORJSONResponse(status_code=status_code, content=content)
 
 # =====================================================
 # FIREBASE / FIRESTORE
 # =====================================================
 
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore_async
+from google.api_core.exceptions import (
+    Aborted,
+    ClientError,
+    DeadlineExceeded,
+    RetryError,
+    ServerError,
+    ServiceUnavailable,
+)
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
 
+# Async client: writes use gRPC's asyncio transport, no thread hop
 db = None
 
 def init_firestore():
     global db
     if firebase_admin._apps:
-        db = firestore.client()
+        db = firestore_async.client()
         return
     
     try:
@@ -156,7 +196,7 @@ def init_firestore():
             logger.info("Firebase: using Application Default credentials")
         
         firebase_admin.initialize_app(cred)
-        db = firestore.client()
+        db = firestore_async.client()
         logger.info("✅ Firestore initialized")
     except Exception as e:
         logger.warning(f"⚠️ Firestore disabled: {e}")
@@ -164,50 +204,183 @@ def init_firestore():
 
 init_firestore()
 
+# Chat logs are queued and written in batches by a background worker
+# so the Firestore RPC never sits on the request path.
+CHAT_LOG_QUEUE_SIZE = 10_000
+CHAT_LOG_BATCH_SIZE = 50
+CHAT_LOG_FLUSH_INTERVAL = 1.0  # seconds
+
+_chat_log_queue: asyncio.Queue = asyncio.Queue(maxsize=CHAT_LOG_QUEUE_SIZE)
+_CHAT_LOG_STOP = object()
+# Set by the lifespan handler. Without it (no lifespan events, or the worker
+# died) entries are written one at a time instead of piling up in the queue.
+_chat_log_task: Optional[asyncio.Task] = None
+_chat_log_direct: set = set()
+_chat_log_warned = False
+
 def save_chat_to_firestore(
-    user_messages: List[Dict[str, Any]], 
+    user_messages: List[Dict[str, Any]],
     assistant_message: Dict[str, Any],
     request_id: str = None
 ):
-    """Save chat interaction to Firestore for analytics."""
+    """Queue a chat interaction for the Firestore analytics log."""
+    global _chat_log_warned
     if not db:
         return
-    
+
+    doc = {
+        "created_at": SERVER_TIMESTAMP,
+        "model": MODEL,
+        "messages": user_messages,
+        "assistant_reply": assistant_message,
+        "request_id": request_id,
+    }
+    if _chat_log_task is None or _chat_log_task.done():
+        if not _chat_log_warned:
+            _chat_log_warned = True
+            logger.warning("Chat log worker not running, writing chat logs directly")
+        task = asyncio.create_task(_write_chat_logs([doc]))
+        _chat_log_direct.add(task)
+        task.add_done_callback(_chat_log_direct.discard)
+        return
+
     try:
-        doc = {
-            "created_at": datetime.utcnow().isoformat() + "Z",
-            "model": MODEL,
-            "messages": user_messages,
-            "assistant_reply": assistant_message,
-            "request_id": request_id,
-        }
-        db.collection("chat_logs").add(doc)
-        logger.debug("Chat logged to Firestore")
+        _chat_log_queue.put_nowait(doc)
+    except asyncio.QueueFull:
+        logger.warning("Chat log queue full, dropping entry")
+
+@with_retry(max_attempts=3, base_delay=0.2, exceptions=(Aborted,))
+async def _commit_chat_logs(docs: List[Dict[str, Any]]):
+    batch = db.batch()
+    for doc in docs:
+        batch.set(db.collection("chat_logs").document(), doc)
+    await batch.commit()
+
+async def _write_chat_logs(docs: List[Dict[str, Any]]):
+    """Commit chat logs in one batch, behind the Firestore breaker."""
+    if not firestore_breaker.allow_request():
+        logger.warning(f"Firestore unavailable, dropping {len(docs)} chat log(s)")
+        return
+
+    try:
+        await _commit_chat_logs(docs)
+        firestore_breaker.record_success()
+        logger.debug(f"Chat logs written to Firestore: {len(docs)}")
     except Exception as e:
-        logger.warning(f"Failed to write chat log: {e}")
+        firestore_breaker.record_failure()
+        logger.warning(f"Failed to write {len(docs)} chat log(s): {e}")
+
+async def _chat_log_worker():
+    """Drain the chat log queue, committing up to one batch per flush interval."""
+    loop = asyncio.get_running_loop()
+    stopping = False
+
+    while not stopping:
+        item = await _chat_log_queue.get()
+        if item is _CHAT_LOG_STOP:
+            break
+
+        docs = [item]
+        deadline = loop.time() + CHAT_LOG_FLUSH_INTERVAL
+        while len(docs) < CHAT_LOG_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_chat_log_queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is _CHAT_LOG_STOP:
+                stopping = True
+                break
+            docs.append(item)
+
+        await _write_chat_logs(docs)
 
 # =====================================================
 # OPENAI CLIENT WITH RETRY
 # =====================================================
 
-from openai import OpenAI, OpenAIError, APIError as OpenAIAPIError, RateLimitError, APIConnectionError
+import httpx
+from openai import (
+    AsyncOpenAI, OpenAIError, APIError as OpenAIAPIError,
+    RateLimitError, APIConnectionError, InternalServerError,
+)
 
 if not OPENAI_API_KEY:
     logger.error("OPENAI_API_KEY is missing!")
     raise RuntimeError("OPENAI_API_KEY is required. Check your .env file.")
 
-oai = OpenAI(api_key=OPENAI_API_KEY)
+def _openai_http_client() -> httpx.AsyncClient:
+    """
+    Shared transport for the OpenAI client.
+    
+    httpx's own connection pool degrades badly past a few dozen concurrent
+    requests, so prefer the aiohttp-backed transport (openai[aiohttp]).
+    Without it, fall back to plain httpx, over HTTP/2 if h2 is installed.
+    """
+    try:
+        import httpx_aiohttp  # noqa: F401
+        from openai import DefaultAioHttpClient
+        return DefaultAioHttpClient()
+    except ImportError:
+        pass
+    
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    # Idle connections stay warm for 30s (httpx's default is 5s), so
+    # requests a few seconds apart don't pay for a new TLS handshake
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=50,
+            keepalive_expiry=30.0,
+        ),
+    )
 
-# Import retry utilities
-from retry import with_retry, RetryExhausted, CircuitBreaker
+# Async client so in-flight completions don't block the event loop;
+# one shared connection pool for the whole process.
+# Retries are handled by @with_retry below, so the SDK's own are disabled.
+oai = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    timeout=httpx.Timeout(30.0, connect=3.0),
+    max_retries=0,
+    http_client=_openai_http_client(),
+)
+
+from util.sse import sse_event_stream
+
+# Optional: share breaker trips across workers/instances through Redis
+REDIS_URL = os.getenv("REDIS_URL")
+_breaker_store = None
+if REDIS_URL:
+    try:
+        _breaker_store = RedisBreakerStore(REDIS_URL)
+        logger.info("✅ Circuit breaker state shared via Redis")
+    except ImportError:
+        logger.warning("redis package not installed, circuit breakers stay per-process")
 
 # Circuit breaker for OpenAI
 openai_breaker = CircuitBreaker(
     failure_threshold=5,
     recovery_timeout=60.0,
     half_open_max_calls=2,
+    initial_recovery_timeout=0.5,
+    name="openai",
+    store=_breaker_store,
+    recovery_ramp=10,
 )
 
+# Concurrency cap so a chat surge can't starve TTS (and vice versa).
+# Size it to the account's rate limit: extra in-flight calls just turn
+# into 429s.
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "50"))
+openai_bulkhead = Bulkhead("openai", max_concurrent=OPENAI_MAX_CONCURRENCY)
+
 # =====================================================
 # ELEVENLABS CLIENT
 # =====================================================
@@ -217,7 +390,7 @@ _eleven_client = None
 if ELEVENLABS_API_KEY:
     try:
         from elevenlabs.client import ElevenLabs
-        _eleven_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+        _eleven_client = ElevenLabs(api_key=ELEVENLABS_API_KEY, timeout=30.0)
         logger.info("✅ ElevenLabs client initialized")
     except ImportError:
         logger.warning("elevenlabs package not installed")
@@ -228,8 +401,14 @@ if ELEVENLABS_API_KEY:
 elevenlabs_breaker = CircuitBreaker(
     failure_threshold=3,
     recovery_timeout=30.0,
+    initial_recovery_timeout=0.5,
+    name="elevenlabs",
+    store=_breaker_store,
+    recovery_ramp=10,
 )
 
+elevenlabs_bulkhead = Bulkhead("elevenlabs", max_concurrent=10)
+
 # =====================================================
 # GOOGLE CLOUD CLIENTS
 # =====================================================
@@ -237,29 +416,90 @@ elevenlabs_breaker = CircuitBreaker(
 _speech_client = None
 _tts_client = None
 
+# Fail fast while Google services are down instead of waiting out each call
+firestore_breaker = CircuitBreaker(
+    failure_threshold=3,
+    recovery_timeout=60.0,
+    initial_recovery_timeout=1.0,
+    name="firestore",
+    store=_breaker_store,
+)
+stt_breaker = CircuitBreaker(
+    failure_threshold=5,
+    recovery_timeout=30.0,
+    initial_recovery_timeout=0.5,
+    name="google_stt",
+    store=_breaker_store,
+    recovery_ramp=10,
+)
+google_tts_breaker = CircuitBreaker(
+    failure_threshold=5,
+    recovery_timeout=30.0,
+    initial_recovery_timeout=0.5,
+    name="google_tts",
+    store=_breaker_store,
+    recovery_ramp=10,
+)
+
+# Only these mean Google's speech services are down or unreachable; a 4xx
+# (bad audio, bad config) is the caller's problem and must not trip them
+_GOOGLE_OUTAGE_ERRORS = (ServerError, ServiceUnavailable, DeadlineExceeded, RetryError)
+
+# Request configs never change, so they're built alongside the clients
+_stt_config = None
+_tts_voice = None
+_tts_audio_config = None
+
 def get_speech_client():
     """Lazily initialize Google Speech client."""
-    global _speech_client
+    global _speech_client, _stt_config
     if _speech_client is None:
         from google.cloud import speech_v1p1beta1 as speech
+        _stt_config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
+                language_code="en-US",
+                enable_automatic_punctuation=True,
+                model="default",
+            ),
+            interim_results=False,
+        )
         _speech_client = speech.SpeechClient()
         logger.info("✅ Google Speech client initialized")
     return _speech_client
 
 def get_tts_client():
     """Lazily initialize Google TTS client."""
-    global _tts_client
+    global _tts_client, _tts_voice, _tts_audio_config
     if _tts_client is None:
         from google.cloud import texttospeech
+        _tts_voice = texttospeech.VoiceSelectionParams(
+            language_code="en-US",
+            ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL,
+        )
+        _tts_audio_config = texttospeech.AudioConfig(
+            audio_encoding=texttospeech.AudioEncoding.MP3
+        )
         _tts_client = texttospeech.TextToSpeechClient()
         logger.info("✅ Google TTS client initialized")
     return _tts_client
 
+def warm_google_clients():
+    """Create the Google clients ahead of the first STT/TTS request."""
+    for get_client in (get_speech_client, get_tts_client):
+        try:
+            get_client()
+        except Exception as e:
+            logger.warning(f"Could not pre-initialize {get_client.__name__}: {e}")
+
 # =====================================================
 # LOCAL TOOLS
 # =====================================================
 
-from tools import get_booking_link, lookup_customer, add_note
+from cachetools import TLRUCache, TTLCache
+from tools import (
+    get_booking_link, lookup_customer, add_note, customer_lookup_key, BOOKING_LINK, EMAIL_RE,
+)
 
 TOOL_SCHEMA = [
     {
@@ -303,6 +543,15 @@ TOOL_SCHEMA = [
     },
 ]
 
+# Provider prompt caching matches on the exact request prefix, and the tool
+# schema is part of it. Follow-up calls that must not call tools keep the
+# schema and set tool_choice="none" instead of dropping it, so they reuse
+# the cached prefix from the first call. The cache key routes every
+# request sharing this prefix to the same cache.
+PROMPT_CACHE_KEY = "mogul-agent"
+_TOOL_KWARGS = {"tools": TOOL_SCHEMA, "tool_choice": "auto"}
+_NO_TOOL_KWARGS = {"tools": TOOL_SCHEMA, "tool_choice": "none"}
+
 TOOL_IMPL = {
     "get_booking_link": get_booking_link,
     "lookup_customer": lookup_customer,
@@ -315,6 +564,9 @@ TOOL_IMPL = {
 
 from prompts import get_system_prompt, SYSTEM_PROMPT
 
+# Shared, never mutated: every request's context starts with this message
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
 # =====================================================
 # CONVERSATION & GUARDRAILS
 # =====================================================
@@ -322,9 +574,14 @@ from prompts import get_system_prompt, SYSTEM_PROMPT
 from conversation import (
     trim_conversation_history,
     count_messages_tokens,
+    context_token_bound,
     validate_messages,
+    cache_prompt_tokens,
 )
 
+# The system prompt is identical on every turn; tokenize it once.
+cache_prompt_tokens(SYSTEM_PROMPT)
+
 from guardrails import (
     full_safety_check,
     validate_tool_call,
@@ -335,6 +592,42 @@ from guardrails import (
 # TOOL EXECUTION
 # =====================================================
 
+# Recent lookup_customer results, keyed by normalized (email, phone).
+# Matches rarely change within a conversation and are kept longer; a miss
+# may turn into a match once the customer is created, so it expires fast.
+CUSTOMER_MATCH_TTL = 120.0
+CUSTOMER_MISS_TTL = 15.0
+
+def _customer_ttu(key, result, now):
+    return now + (CUSTOMER_MATCH_TTL if result.get("match") else CUSTOMER_MISS_TTL)
+
+_customer_cache: TLRUCache = TLRUCache(maxsize=10_000, ttu=_customer_ttu)
+
+async def _call_lookup_customer(args: Dict[str, Any]) -> Dict[str, Any]:
+    email, phone = args.get("email"), args.get("phone")
+    if not email and not phone:
+        return {"error": "provide_email_or_phone"}
+    
+    key = customer_lookup_key(email, phone)
+    cached = _customer_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    result = await lookup_customer(email=email, phone=phone)
+    if result.get("ok"):
+        _customer_cache[key] = result
+    return result
+
+def _call_with_kwargs(fn):
+    async def call(args: Dict[str, Any]) -> Dict[str, Any]:
+        return await fn(**args)
+    return call
+
+# Tool name -> adapter taking the parsed arguments dict. Tools needing
+# argument handling get their own adapter; the rest are called as-is.
+_TOOL_DISPATCH = {name: _call_with_kwargs(fn) for name, fn in TOOL_IMPL.items()}
+_TOOL_DISPATCH["lookup_customer"] = _call_lookup_customer
+
 async def _run_one_tool(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
     """Execute a single tool call safely."""
     # Validate tool call
@@ -343,19 +636,13 @@ async def _run_one_tool(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
         logger.warning(f"Invalid tool call: {error}")
         return {"error": "invalid_tool_call", "detail": error}
     
-    fn = TOOL_IMPL.get(name)
-    if fn is None:
+    call = _TOOL_DISPATCH.get(name)
+    if call is None:
         logger.warning(f"Unknown tool called: {name}")
         return {"error": "unknown_tool", "tool": name}
     
     try:
-        if name == "lookup_customer":
-            email, phone = args.get("email"), args.get("phone")
-            if not email and not phone:
-                return {"error": "provide_email_or_phone"}
-            return await fn(email=email, phone=phone)
-        
-        return await fn(**args)
+        return await call(args)
     except Exception as e:
         logger.error(f"Tool execution error ({name}): {e}")
         return {"error": "tool_execution_failed", "detail": str(e)}
@@ -374,23 +661,46 @@ def _assistant_tool_call_dict(msg_obj) -> dict:
         })
     return {"role": "assistant", "tool_calls": calls}
 
-async def _apply_tool_calls(base_msgs: List[dict], msg_obj) -> List[dict]:
-    """Execute all tool calls and build the response messages."""
-    tool_msgs: List[dict] = []
-    assistant_tool = _assistant_tool_call_dict(msg_obj)
+# Upper bound on a single tool call so one slow tool can't stall the turn
+TOOL_TIMEOUT_SECONDS = 5.0
+
+async def _run_tool_with_timeout(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return await asyncio.wait_for(_run_one_tool(name, args), timeout=TOOL_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning(f"Tool call timed out ({name})")
+        return {"error": "tool_timeout", "tool": name}
+
+def _parse_args(raw: Optional[str]) -> Dict[str, Any]:
+    """Parse tool-call arguments; zero-arg tools (the common case) skip the parser."""
+    if not raw or raw == "{}":
+        return {}
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return {}
+
+async def _apply_tool_calls(base_msgs: List[dict], assistant_tool: dict) -> List[dict]:
+    """Execute all tool calls concurrently and build the response messages."""
+    calls = assistant_tool["tool_calls"]
     
-    for tc in (msg_obj.tool_calls or []):
-        try:
-            args = json.loads(tc.function.arguments or "{}")
-        except json.JSONDecodeError:
-            args = {}
-        
-        result = await _run_one_tool(tc.function.name, args)
+    coros = []
+    for tc in calls:
+        args = _parse_args(tc["function"]["arguments"])
+        coros.append(_run_tool_with_timeout(tc["function"]["name"], args))
+    
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    
+    tool_msgs: List[dict] = []
+    for tc, result in zip(calls, results):
+        if isinstance(result, Exception):
+            logger.error(f"Tool execution error ({tc['function']['name']}): {result}")
+            result = {"error": "tool_execution_failed", "detail": str(result)}
         
         tool_msgs.append({
             "role": "tool",
-            "tool_call_id": tc.id,
-            "content": json.dumps(result),
+            "tool_call_id": tc["id"],
+            "content": orjson.dumps(result, default=str).decode(),
         })
     
     return base_msgs + [assistant_tool] + tool_msgs
@@ -399,14 +709,28 @@ async def _apply_tool_calls(base_msgs: List[dict], msg_obj) -> List[dict]:
 # OPENAI CALL WITH RETRY
 # =====================================================
 
+# Transient failures worth retrying: 429s, connection errors and timeouts
+# (APITimeoutError is an APIConnectionError), and 5xx from OpenAI
+_OPENAI_RETRYABLE = (RateLimitError, APIConnectionError, InternalServerError)
+
 @with_retry(
     max_attempts=3,
     base_delay=1.0,
     backoff_factor=2.0,
-    exceptions=(RateLimitError, APIConnectionError),
+    exceptions=_OPENAI_RETRYABLE,
 )
-async def call_openai_with_retry(messages: List[dict], use_tools: bool = True):
-    """Call OpenAI API with retry logic."""
+async def call_openai_with_retry(
+    messages: List[dict],
+    use_tools: bool = True,
+    stream: bool = False,
+):
+    """
+    Call OpenAI API with retry logic.
+    
+    With stream=True the returned object is an async generator of chunks
+    that holds its bulkhead slot until it is exhausted or closed; consume
+    it inside aclosing(). Only opening the stream is retried.
+    """
     # Check circuit breaker
     if not openai_breaker.allow_request():
         raise APIError(
@@ -419,18 +743,38 @@ async def call_openai_with_retry(messages: List[dict], use_tools: bool = True):
         kwargs = {
             "model": MODEL,
             "messages": messages,
-            "stream": False,
+            "stream": stream,
+            "prompt_cache_key": PROMPT_CACHE_KEY,
+            **(_TOOL_KWARGS if use_tools else _NO_TOOL_KWARGS),
         }
         
-        if use_tools:
-            kwargs["tools"] = TOOL_SCHEMA
-            kwargs["tool_choice"] = "auto"
+        if stream:
+            await openai_bulkhead.acquire()
+            try:
+                response = await oai.chat.completions.create(**kwargs)
+            except BaseException:
+                openai_bulkhead.release()
+                raise
+            openai_breaker.record_success()
+            return _stream_in_slot(response)
         
-        response = oai.chat.completions.create(**kwargs)
+        async with openai_bulkhead.slot():
+            response = await oai.chat.completions.create(**kwargs)
         openai_breaker.record_success()
         return response
         
-    except (RateLimitError, APIConnectionError) as e:
+    except BulkheadFull:
+        openai_breaker.release_probe()
+        raise APIError(
+            status_code=503,
+            error_code="service_busy",
+            message="AI service is busy. Please try again in a moment."
+        )
+    except asyncio.CancelledError:
+        # Client went away mid-call: no verdict on the service either way
+        openai_breaker.release_probe()
+        raise
+    except _OPENAI_RETRYABLE:
         openai_breaker.record_failure()
         raise  # Will be retried
     except OpenAIError as e:
@@ -442,24 +786,105 @@ async def call_openai_with_retry(messages: List[dict], use_tools: bool = True):
             detail=str(e)
         )
 
-async def run_with_tools(messages: List[dict], user_id: str = "anonymous") -> dict:
-    """Run chat completion with tool support, retry logic, and safety checks."""
+async def _stream_in_slot(response):
+    """Relay a streamed completion, releasing its bulkhead slot when it ends."""
+    try:
+        async for chunk in response:
+            yield chunk
+    finally:
+        try:
+            await response.close()
+        finally:
+            openai_bulkhead.release()
+
+BLOCKED_REPLY = {
+    "role": "assistant",
+    "content": "I'm sorry, but I can't process that request. Please rephrase your question."
+}
+
+# Booking fast path. Once the user has answered the name prompt and given
+# an email (the booking flow in the system prompt), a short "book a call" /
+# "send me the link" turn is answered from a template instead of two model
+# round trips. Anything hedged, negated or longer still goes to the model.
+BOOK_INTENT = re.compile(
+    r"^(?:(?:ok(?:ay)?|yes|yeah|sure|great|perfect|please|let'?s|can you|could you"
+    r"|i want to|i'?d like to)\W+)*"
+    r"(?:book|schedule|set up|send|share)\b.*\b(?:call|meeting|time|link)\b",
+    re.IGNORECASE,
+)
+BOOK_NEGATION = re.compile(r"\b(?:no|not|never|cancel|stop|later|instead)\b|n'?t\b", re.IGNORECASE)
+BOOK_NAME_PROMPT = re.compile(r"\byour (?:full )?name\b", re.IGNORECASE)
+BOOK_INTENT_MAX_CHARS = 80
+BOOKING_REPLY = {
+    "role": "assistant",
+    "content": f"Here's the direct booking link: {BOOKING_LINK['url']} — pick any time that works for you!",
+}
+
+def _booking_fast_reply(base_msgs: List[dict]) -> Optional[dict]:
+    """Templated booking reply, or None if the turn needs the model."""
+    last = base_msgs[-1]
+    content = last.get("content")
+    if (
+        last["role"] != "user"
+        or not isinstance(content, str)
+        or len(content) > BOOK_INTENT_MAX_CHARS
+        or not BOOK_INTENT.match(content.strip())
+        or BOOK_NEGATION.search(content)
+    ):
+        return None
     
+    # A name counts as given when a user turn answers the assistant's name prompt
+    asked_name = has_name = has_email = False
+    for m in base_msgs[:-1]:
+        text = m.get("content")
+        if not isinstance(text, str):
+            continue
+        if m["role"] == "assistant":
+            asked_name = bool(BOOK_NAME_PROMPT.search(text))
+        elif m["role"] == "user":
+            has_name = has_name or asked_name
+            has_email = has_email or bool(EMAIL_RE.search(text))
+            asked_name = False
+    
+    if has_name and has_email:
+        return dict(BOOKING_REPLY)
+    return None
+
+def _is_booking_link_only(tool_names: List[str]) -> bool:
+    """
+    True if the model only asked for the booking link. Its result is a
+    constant, so the reply can be written locally instead of spending a
+    second completion on rephrasing the URL.
+    """
+    return tool_names == ["get_booking_link"]
+
+def _prepare_context(
+    messages: List[dict],
+    user_id: str,
+    record_abuse: bool = True,
+) -> Optional[List[dict]]:
+    """
+    Run safety checks, add the system prompt and trim to the context window.
+    
+    Returns None if the request was blocked by guardrails.
+    """
     # 1. Run safety checks if enabled
     if ENABLE_GUARDRAILS:
-        is_safe, block_reason, messages = full_safety_check(messages, user_id)
+        is_safe, block_reason, messages = full_safety_check(messages, user_id, record_abuse)
         if not is_safe:
             logger.warning(f"Request blocked: {block_reason}", extra={"user_id": user_id})
-            return {
-                "role": "assistant",
-                "content": "I'm sorry, but I can't process that request. Please rephrase your question."
-            }
+            return None
     else:
         # At minimum, sanitize inputs
         messages = sanitize_messages(messages)
     
     # 2. Add system prompt and trim to fit context window
-    base_msgs = [{"role": "system", "content": SYSTEM_PROMPT}] + messages
+    base_msgs = [_SYSTEM_MSG, *messages]
+    bound = context_token_bound(base_msgs)
+    if bound is not None and bound <= MAX_CONTEXT_TOKENS:
+        # Fits even by the byte bound: nothing to trim, nothing to encode
+        logger.info(f"Request context: <={bound} tokens, {len(base_msgs)} messages")
+        return base_msgs
     base_msgs = trim_conversation_history(
         base_msgs,
         model=MODEL,
@@ -470,6 +895,64 @@ async def run_with_tools(messages: List[dict], user_id: str = "anonymous") -> di
     token_count = count_messages_tokens(base_msgs)
     logger.info(f"Request context: {token_count} tokens, {len(base_msgs)} messages")
     
+    return base_msgs
+
+# Recent tool-free replies, keyed by the normalized last user turn plus
+# the whole conversation before it. The cache is shared across users, so
+# the key must cover everything a reply could depend on (a name given in
+# the first message, "summarize what we discussed"). Callers repeat the
+# same opening questions ("what do you do", "how much"), and those answers
+# don't depend on anything looked up.
+# Only short conversations are cached: past the first few turns a history
+# practically never repeats, so hashing and storing it is wasted work.
+REPLY_CACHE_MAX_HISTORY = 5  # non-system messages, including the last turn
+_reply_cache: TTLCache = TTLCache(maxsize=1000, ttl=600)
+
+def _reply_cache_key(base_msgs: List[dict]) -> Optional[str]:
+    """Cache key for a prepared context, or None if it shouldn't be cached."""
+    last = base_msgs[-1]
+    content = last.get("content")
+    if last["role"] != "user" or not isinstance(content, str):
+        return None
+    # base_msgs[0] is the system prompt
+    if len(base_msgs) - 1 > REPLY_CACHE_MAX_HISTORY:
+        return None
+    
+    h = hashlib.sha256(" ".join(content.lower().split()).encode())
+    for m in base_msgs[:-1]:
+        if m["role"] == "system":
+            continue
+        h.update(b"\x00")
+        h.update(m["role"].encode())
+        h.update(b"\x00")
+        h.update(str(m.get("content")).encode())
+    return h.hexdigest()
+
+def _retries_exhausted_error(e: RetryExhausted) -> APIError:
+    log_error(f"All retries exhausted after {e.attempts} attempts", e.last_exception)
+    return APIError(
+        status_code=503,
+        error_code="service_unavailable",
+        message="AI service is currently overloaded. Please try again in a moment.",
+        detail=str(e.last_exception)
+    )
+
+async def run_with_tools(messages: List[dict], user_id: str = "anonymous") -> dict:
+    """Run chat completion with tool support, retry logic, and safety checks."""
+    base_msgs = _prepare_context(messages, user_id)
+    if base_msgs is None:
+        return dict(BLOCKED_REPLY)
+    
+    booking = _booking_fast_reply(base_msgs)
+    if booking is not None:
+        return booking
+    
+    cache_key = _reply_cache_key(base_msgs)
+    if cache_key is not None:
+        cached = _reply_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+    
     try:
         # 3. Make API call with retry
         first_resp = await call_openai_with_retry(base_msgs, use_tools=True)
@@ -479,57 +962,209 @@ async def run_with_tools(messages: List[dict], user_id: str = "anonymous") -> di
         
         # 4. Handle tool calls if needed
         if choice.finish_reason == "tool_calls" and msg.tool_calls:
+            if _is_booking_link_only([tc.function.name for tc in msg.tool_calls]):
+                if not msg.content:
+                    return dict(BOOKING_REPLY)
+                return {"role": "assistant", "content": f"{msg.content}\n\n{BOOKING_REPLY['content']}"}
+            
             logger.info(f"Executing {len(msg.tool_calls)} tool call(s)")
-            msgs_with_tools = await _apply_tool_calls(base_msgs, msg)
+            msgs_with_tools = await _apply_tool_calls(base_msgs, _assistant_tool_call_dict(msg))
             
             # Second call (no tools, just get response)
             second_resp = await call_openai_with_retry(msgs_with_tools, use_tools=False)
             return second_resp.choices[0].message.model_dump()
         
-        return msg.model_dump()
+        # Only replies that didn't go through tools are cached; tool results
+        # are specific to whoever asked
+        message = msg.model_dump()
+        if cache_key is not None and message.get("content"):
+            _reply_cache[cache_key] = message
+        return message
         
     except RetryExhausted as e:
-        logger.error(f"All retries exhausted: {e.last_exception}")
-        raise APIError(
-            status_code=503,
-            error_code="service_unavailable",
-            message="AI service is currently overloaded. Please try again in a moment.",
-            detail=str(e.last_exception)
-        )
+        raise _retries_exhausted_error(e)
+
+async def stream_with_tools(messages: List[dict], user_id: str = "anonymous"):
+    """
+    Streaming variant of run_with_tools.
+    
+    Yields {"delta": str} events as tokens arrive. Tool-call deltas are
+    accumulated; once the model finishes with tool calls, the tools are run
+    and the follow-up completion is streamed. The last event is
+    {"done": True, "message": <assembled assistant message>}.
+    """
+    base_msgs = _prepare_context(messages, user_id)
+    if base_msgs is None:
+        yield {"delta": BLOCKED_REPLY["content"]}
+        yield {"done": True, "message": dict(BLOCKED_REPLY)}
+        return
+    
+    booking = _booking_fast_reply(base_msgs)
+    if booking is not None:
+        yield {"delta": booking["content"]}
+        yield {"done": True, "message": booking}
+        return
+    
+    cache_key = _reply_cache_key(base_msgs)
+    if cache_key is not None:
+        cached = _reply_cache.get(cache_key)
+        if cached is not None:
+            yield {"delta": cached["content"]}
+            yield {"done": True, "message": dict(cached)}
+            return
+    
+    try:
+        parts: List[str] = []
+        tool_calls: Dict[int, dict] = {}
+        finish_reason = None
+        
+        stream = await call_openai_with_retry(base_msgs, use_tools=True, stream=True)
+        async with aclosing(stream):
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                delta = choice.delta
+                if delta.content:
+                    parts.append(delta.content)
+                    yield {"delta": delta.content}
+                for tc in (delta.tool_calls or []):
+                    call = tool_calls.setdefault(tc.index, {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    })
+                    if tc.id:
+                        call["id"] = tc.id
+                    if tc.function and tc.function.name:
+                        call["function"]["name"] += tc.function.name
+                    if tc.function and tc.function.arguments:
+                        call["function"]["arguments"] += tc.function.arguments
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+        
+        if finish_reason == "tool_calls" and tool_calls:
+            calls = [tool_calls[i] for i in sorted(tool_calls)]
+            if _is_booking_link_only([tc["function"]["name"] for tc in calls]):
+                # Keep any text the model streamed before asking for the link
+                delta = ("\n\n" if parts else "") + BOOKING_REPLY["content"]
+                yield {"delta": delta}
+                yield {"done": True, "message": {"role": "assistant", "content": "".join(parts) + delta}}
+                return
+            
+            logger.info(f"Executing {len(tool_calls)} tool call(s)")
+            assistant_tool = {"role": "assistant", "tool_calls": calls}
+            msgs_with_tools = await _apply_tool_calls(base_msgs, assistant_tool)
+            
+            # Second call (no tools), streamed straight through
+            parts = []
+            stream = await call_openai_with_retry(msgs_with_tools, use_tools=False, stream=True)
+            async with aclosing(stream):
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        content = chunk.choices[0].delta.content
+                        parts.append(content)
+                        yield {"delta": content}
+        
+        message = {"role": "assistant", "content": "".join(parts)}
+        if cache_key is not None and not tool_calls and message["content"]:
+            _reply_cache[cache_key] = message
+        yield {"done": True, "message": message}
+        
+    except RetryExhausted as e:
+        raise _retries_exhausted_error(e)
 
 # =====================================================
 # REQUEST / RESPONSE MODELS
 # =====================================================
 
-from typing import Literal
+from typing import Literal, get_args
 
 Role = Literal["system", "user", "assistant", "tool"]
 
-class Message(BaseModel):
-    role: Role
-    content: Optional[str] = None
-    name: Optional[str] = None
-    tool_call_id: Optional[str] = None
+_ROLES = frozenset(get_args(Role))
+_MESSAGE_FIELDS = ("role", "content", "name", "tool_call_id")
+
+def _invalid_request(message: str) -> APIError:
+    return APIError(status_code=422, error_code="invalid_request", message=message)
+
+def parse_chat_messages(raw: bytes) -> List[dict]:
+    """
+    Parse a chat request body straight into OpenAI-ready message dicts.
     
-    @field_validator('content')
-    @classmethod
-    def content_not_empty_for_user(cls, v, info):
-        if info.data.get('role') == 'user' and (v is None or v.strip() == ''):
-            raise ValueError('User message content cannot be empty')
-        return v
+    Only the shape is checked here; content itself is screened by the
+    guardrails. Unknown keys (e.g. refusal/annotations on assistant
+    messages echoed back by the web UI) are dropped, as are nulls.
+    """
+    try:
+        payload = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        raise _invalid_request("Request body must be valid JSON")
+    
+    messages = payload.get("messages") if isinstance(payload, dict) else None
+    return _parse_message_list(messages)
 
-class ChatRequest(BaseModel):
-    messages: List[Message]
+def _parse_message_list(messages: Any) -> List[dict]:
+    """Validate one conversation's messages; see parse_chat_messages."""
+    if not isinstance(messages, list) or not messages:
+        raise _invalid_request("Messages list cannot be empty")
     
-    @field_validator('messages')
-    @classmethod
-    def messages_not_empty(cls, v):
-        if not v:
-            raise ValueError('Messages list cannot be empty')
-        return v
+    parsed = []
+    for i, msg in enumerate(messages):
+        if not isinstance(msg, dict) or msg.get("role") not in _ROLES:
+            raise _invalid_request(f"Message {i}: role must be one of {sorted(_ROLES)}")
+        
+        clean = {}
+        for field in _MESSAGE_FIELDS:
+            value = msg.get(field)
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                raise _invalid_request(f"Message {i}: {field} must be a string")
+            clean[field] = value
+        
+        if clean["role"] == "user" and not clean.get("content", "").strip():
+            raise _invalid_request(f"Message {i}: User message content cannot be empty")
+        
+        parsed.append(clean)
+    
+    return parsed
 
-class ChatResponse(BaseModel):
-    message: Dict[str, Any]
+MAX_BATCH_CHATS = 1000
+
+def parse_chat_batch(raw: bytes) -> List[tuple]:
+    """
+    Parse a /v1/chat/batch body: {"chats": [{"custom_id": str?, "messages": [...]}]}.
+    
+    Returns (custom_id, messages) pairs; custom_id defaults to the chat's index.
+    """
+    try:
+        payload = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        raise _invalid_request("Request body must be valid JSON")
+    
+    chats = payload.get("chats") if isinstance(payload, dict) else None
+    if not isinstance(chats, list) or not chats:
+        raise _invalid_request("Chats list cannot be empty")
+    if len(chats) > MAX_BATCH_CHATS:
+        raise _invalid_request(f"Too many chats (max {MAX_BATCH_CHATS})")
+    
+    parsed = []
+    seen = set()
+    for i, chat in enumerate(chats):
+        if not isinstance(chat, dict):
+            raise _invalid_request(f"Chat {i}: must be an object")
+        custom_id = chat.get("custom_id", str(i))
+        if not isinstance(custom_id, str) or not custom_id or custom_id in seen:
+            raise _invalid_request(f"Chat {i}: custom_id must be a unique, non-empty string")
+        seen.add(custom_id)
+        try:
+            messages = _parse_message_list(chat.get("messages"))
+        except APIError as e:
+            raise _invalid_request(f"Chat {i}: {e.message}")
+        parsed.append((custom_id, messages))
+    
+    return parsed
 
 class TTSRequest(BaseModel):
     text: str
@@ -552,14 +1187,36 @@ async def lifespan(app: FastAPI):
     """Application lifespan handler."""
     logger.info("🚀 Mogul AI Agent API starting...")
     logger.info(f"Environment: {ENVIRONMENT}")
+    global _chat_log_task
+    _chat_log_task = asyncio.create_task(_chat_log_worker()) if db else None
+    # Channel setup and credential loading take a while; do it now, in the
+    # background, rather than on the first voice request
+    warmup_task = asyncio.create_task(asyncio.to_thread(warm_google_clients))
     yield
+    warmup_task.cancel()
     logger.info("👋 Mogul AI Agent API shutting down...")
+    await oai.close()
+    if _breaker_store:
+        await _breaker_store.close()
+    if _chat_log_task:
+        # Let the worker flush whatever is still queued before exiting. If
+        # the queue is full the sentinel can't go in; the worker keeps
+        # draining until the timeout cancels it.
+        try:
+            _chat_log_queue.put_nowait(_CHAT_LOG_STOP)
+        except asyncio.QueueFull:
+            logger.warning("Chat log queue full at shutdown, flushing until timeout")
+        try:
+            await asyncio.wait_for(_chat_log_task, timeout=10.0)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out flushing chat logs on shutdown")
 
 app = FastAPI(
     title="Mogul AI Agent API",
     description="AI-powered customer service assistant for Mogul Design Agency",
     version="2.1.0",  # Updated version for Phase 2
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs" if DEBUG else None,
     redoc_url="/redoc" if DEBUG else None,
 )
@@ -618,7 +1275,7 @@ async def api_error_handler(request: Request, exc: APIError):
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     request_id = getattr(request.state, 'request_id', None)
-    logger.error(f"Unhandled exception: {exc}", exc_info=True)
+    logger.exception(f"Unhandled exception ({error_fingerprint(exc)}): {exc}")
     return error_response(
         status_code=500,
         error_code="internal_error",
@@ -639,6 +1296,25 @@ def get_user_id(request: Request) -> str:
     """Dependency to get current user ID."""
     return getattr(request.state, 'user_id', None) or "anonymous"
 
+def get_authenticated_user_id(request: Request) -> str:
+    """Dependency for routes that need a real user even when auth is optional."""
+    user_id = getattr(request.state, 'user_id', None)
+    if not user_id:
+        raise APIError(
+            status_code=401,
+            error_code="unauthorized",
+            message="Authentication required"
+        )
+    return user_id
+
+async def get_chat_messages(request: Request) -> List[dict]:
+    """Dependency to parse the chat body without a Pydantic round-trip."""
+    return parse_chat_messages(await request.body())
+
+async def get_chat_batch(request: Request) -> List[tuple]:
+    """Dependency to parse a batch chat body."""
+    return parse_chat_batch(await request.body())
+
 # =====================================================
 # ROUTES
 # =====================================================
@@ -651,53 +1327,66 @@ async def root():
 async def favicon():
     return Response(status_code=204)
 
+# Fields that are fixed once the module has loaded
+_HEALTH_STATIC = {
+    "ok": True,
+    "environment": ENVIRONMENT,
+    "openai": bool(OPENAI_API_KEY),
+    "firestore": db is not None,
+    "elevenlabs": _eleven_client is not None,
+    "guardrails": ENABLE_GUARDRAILS,
+    "model": MODEL,
+}
+
+_CONFIG_JSON = orjson.dumps({
+    "calLink": os.getenv("CALCOM_EVENT_LINK", "").strip(),
+    "brandColor": os.getenv("CALCOM_BRAND_COLOR", "#111827").strip(),
+})
+
 @app.get("/healthz")
 async def healthz():
     """Health check endpoint."""
-    return {
-        "ok": True,
-        "environment": ENVIRONMENT,
-        "openai": bool(OPENAI_API_KEY),
+    return ORJSONResponse({
+        **_HEALTH_STATIC,
         "openai_circuit": openai_breaker.state,
-        "firestore": db is not None,
-        "elevenlabs": _eleven_client is not None,
         "elevenlabs_circuit": elevenlabs_breaker.state if _eleven_client else "disabled",
-        "guardrails": ENABLE_GUARDRAILS,
-        "model": MODEL,
-    }
+        "stt_circuit": stt_breaker.state,
+        "google_tts_circuit": google_tts_breaker.state,
+        "firestore_circuit": firestore_breaker.state if db else "disabled",
+        "in_flight": {
+            "openai": openai_bulkhead.in_flight,
+            "elevenlabs": elevenlabs_bulkhead.in_flight,
+        },
+    })
 
 @app.get("/config")
 def get_config():
     """Get frontend configuration."""
-    return {
-        "calLink": os.getenv("CALCOM_EVENT_LINK", "").strip(),
-        "brandColor": os.getenv("CALCOM_BRAND_COLOR", "#111827").strip(),
-    }
+    return Response(content=_CONFIG_JSON, media_type="application/json")
 
 # =====================================================
 # CHAT ENDPOINT
 # =====================================================
 
-@app.post("/v1/chat", response_model=ChatResponse)
+@app.post("/v1/chat")
 async def chat(
-    req: ChatRequest,
+    incoming: List[dict] = Depends(get_chat_messages),
     request_id: str = Depends(get_request_id),
     user_id: str = Depends(get_user_id),
 ):
     """Main chat endpoint with AI assistant."""
     try:
-        incoming = [m.model_dump(exclude_none=True) for m in req.messages]
         logger.info(f"Chat request: {len(incoming)} message(s)", extra={"user_id": user_id})
         
         message = await run_with_tools(incoming, user_id=user_id)
         save_chat_to_firestore(incoming, message, request_id)
         
-        return {"message": message}
+        return ORJSONResponse({"message": message})
         
     except APIError:
         raise
     except Exception as e:
-        logger.error(f"Chat error: {e}", exc_info=True)
+        log_error("Chat error", e)
         raise APIError(
             status_code=500,
             error_code="chat_error",
@@ -705,10 +1394,234 @@ async def chat(
             detail=str(e)
         )
 
+@app.post("/v1/chat/stream")
+async def chat_stream(
+    incoming: List[dict] = Depends(get_chat_messages),
+    request_id: str = Depends(get_request_id),
+    user_id: str = Depends(get_user_id),
+):
+    """Chat endpoint that streams the reply as Server-Sent Events."""
+    logger.info(f"Chat stream request: {len(incoming)} message(s)", extra={"user_id": user_id})
+    
+    async def events():
+        try:
+            async for event in stream_with_tools(incoming, user_id=user_id):
+                if event.get("done"):
+                    save_chat_to_firestore(incoming, event["message"], request_id)
+                yield orjson.dumps(event).decode()
+        except APIError as e:
+            yield orjson.dumps({"error": e.error_code, "message": e.message}).decode()
+        except Exception as e:
+            log_error("Chat stream error", e)
+            yield orjson.dumps({
+                "error": "chat_error",
+                "message": "Failed to process your message. Please try again.",
+            }).decode()
+    
+    return StreamingResponse(
+        sse_event_stream(events()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+# =====================================================
+# BATCH CHAT ENDPOINT
+# =====================================================
+
+# Offline workloads (evals, replaying chat logs, digest replies) go through
+# OpenAI's Batch API: half the price, results within 24h, and none of it
+# counts against the real-time rate limit. Batch requests can't run tools
+# mid-completion, so the schema is sent with tool_choice="none"; that also
+# keeps the prompt prefix identical to live traffic.
+
+_BATCH_FINAL_STATES = frozenset({"completed", "expired", "cancelled", "failed"})
+
+def _batch_line(custom_id: str, base_msgs: List[dict]) -> bytes:
+    return orjson.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": MODEL,
+            "messages": base_msgs,
+            "prompt_cache_key": PROMPT_CACHE_KEY,
+            **_NO_TOOL_KWARGS,
+        },
+    })
+
+def _parse_batch_line(line: str) -> dict:
+    """One output/error file row as {custom_id, message | error}."""
+    try:
+        row = orjson.loads(line)
+        response = row.get("response") or {}
+        body = response.get("body") or {}
+        if row.get("error") or response.get("status_code") != 200:
+            return {
+                "custom_id": row.get("custom_id"),
+                "error": row.get("error") or body.get("error"),
+            }
+        return {
+            "custom_id": row.get("custom_id"),
+            "message": body["choices"][0]["message"],
+        }
+    except (orjson.JSONDecodeError, AttributeError, KeyError, IndexError, TypeError):
+        # One bad row shouldn't hide every other result
+        return {"custom_id": None, "error": {"code": "unparseable_result", "line": line[:200]}}
+
+def _parse_batch_output(text: str) -> List[dict]:
+    """Turn a batch output/error file into [{custom_id, message | error}]."""
+    return [_parse_batch_line(line) for line in text.splitlines() if line]
+
+def _prepare_batch(chats: List[tuple], user_id: str) -> Tuple[List[bytes], List[str]]:
+    """
+    Guardrails and context trimming for every chat in a batch.
+    
+    Tokenizing up to MAX_BATCH_CHATS histories is CPU-bound, so this runs
+    in a worker thread. Abuse tracking is skipped: a batch routinely
+    repeats the same question, and its chats mustn't fill the duplicate
+    and injection counters live users share.
+    """
+    lines = []
+    blocked = []
+    for custom_id, messages in chats:
+        base_msgs = _prepare_context(messages, user_id, record_abuse=False)
+        if base_msgs is None:
+            blocked.append(custom_id)
+            continue
+        lines.append(_batch_line(custom_id, base_msgs))
+    return lines, blocked
+
+def _batches_unavailable() -> APIError:
+    return APIError(
+        status_code=503,
+        error_code="service_unavailable",
+        message="Batch chat is unavailable: batch ownership is tracked in Firestore."
+    )
+
+def _batch_not_found() -> APIError:
+    return APIError(status_code=404, error_code="not_found", message="Batch not found")
+
+@app.post("/v1/chat/batch")
+async def chat_batch(
+    user_id: str = Depends(get_authenticated_user_id),  # before the body is parsed
+    chats: List[tuple] = Depends(get_chat_batch),
+    request_id: str = Depends(get_request_id),
+):
+    """Submit independent chats to the OpenAI Batch API."""
+    # Results are only handed back to the user recorded as the batch's
+    # owner, so without Firestore nothing could ever be retrieved. Batches
+    # always need a signed-in owner: "anonymous" would be shared by everyone.
+    if not db or not firestore_breaker.allow_request():
+        raise _batches_unavailable()
+    
+    lines, blocked = await asyncio.to_thread(_prepare_batch, chats, user_id)
+    
+    if not lines:
+        raise _invalid_request("Every chat in the batch was blocked by safety checks")
+    
+    try:
+        input_file = await oai.files.create(
+            file=("chat_batch.jsonl", b"\n".join(lines)),
+            purpose="batch",
+        )
+        batch = await oai.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"request_id": request_id or "", "user_id": user_id},
+        )
+    except OpenAIError as e:
+        raise APIError(
+            status_code=502,
+            error_code="openai_error",
+            message="Failed to submit chat batch",
+            detail=str(e)
+        )
+    
+    try:
+        await db.collection("chat_batches").document(batch.id).set({
+            "created_at": SERVER_TIMESTAMP,
+            "model": MODEL,
+            "count": len(lines),
+            "blocked": blocked,
+            "request_id": request_id,
+            "user_id": user_id,
+        })
+        firestore_breaker.record_success()
+    except Exception as e:
+        firestore_breaker.record_failure()
+        log_error(f"Failed to record chat batch {batch.id}", e)
+        # Unrecorded batches can't be retrieved; don't leave one running
+        try:
+            await oai.batches.cancel(batch.id)
+        except OpenAIError as cancel_error:
+            logger.warning(f"Failed to cancel unrecorded chat batch {batch.id}: {cancel_error}")
+        raise _batches_unavailable()
+    
+    logger.info(f"Chat batch {batch.id} submitted: {len(lines)} chat(s), {len(blocked)} blocked")
+    
+    return ORJSONResponse({
+        "batch_id": batch.id,
+        "status": batch.status,
+        "count": len(lines),
+        "blocked": blocked,
+    })
+
+@app.get("/v1/chat/batch/{batch_id}")
+async def chat_batch_status(
+    batch_id: str,
+    user_id: str = Depends(get_authenticated_user_id),
+):
+    """Batch status; once finished, includes the parsed results."""
+    # Only batches this app submitted, and only to the user who submitted
+    # them; the OpenAI account may hold batches from anything else
+    if not db or not firestore_breaker.allow_request():
+        raise _batches_unavailable()
+    try:
+        record = await db.collection("chat_batches").document(batch_id).get()
+        firestore_breaker.record_success()
+    except ValueError:
+        raise _batch_not_found()  # not a valid document id
+    except Exception as e:
+        firestore_breaker.record_failure()
+        log_error("Failed to load chat batch record", e)
+        raise _batches_unavailable()
+    if not record.exists or (record.to_dict() or {}).get("user_id") != user_id:
+        raise _batch_not_found()
+    
+    try:
+        batch = await oai.batches.retrieve(batch_id)
+        results = None
+        if batch.status in _BATCH_FINAL_STATES:
+            results = []
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = await oai.files.content(file_id)
+                    results.extend(_parse_batch_output(content.text))
+    except OpenAIError as e:
+        raise APIError(
+            status_code=502,
+            error_code="openai_error",
+            message="Failed to fetch chat batch",
+            detail=str(e)
+        )
+    
+    counts = batch.request_counts
+    return ORJSONResponse({
+        "batch_id": batch.id,
+        "status": batch.status,
+        "request_counts": counts.model_dump() if counts else None,
+        "errors": batch.errors.model_dump() if batch.errors else None,
+        "results": results,
+    })
+
 # =====================================================
 # SPEECH-TO-TEXT ENDPOINT
 # =====================================================
 
+# Streaming requests are capped at 25KB of audio each
+STT_CHUNK_BYTES = 16 * 1024
+
 @app.post("/v1/stt")
 async def speech_to_text(
     audio: UploadFile = File(...),
@@ -716,43 +1629,74 @@ async def speech_to_text(
 ):
     """Convert audio to text using Google Speech-to-Text."""
     try:
-        content = await audio.read()
+        # Size is known from the parsed upload; no need to read it first
+        size = audio.size
+        if size is None:
+            size = audio.file.seek(0, io.SEEK_END)
+            audio.file.seek(0)
         
-        if len(content) < 1000:
+        if size < 1000:
             logger.info("STT: Audio too short")
             return {"text": "", "error": "audio_too_short"}
         
-        if len(content) > 10 * 1024 * 1024:
+        if size > 10 * 1024 * 1024:
             raise HTTPException(status_code=413, detail="Audio file too large (max 10MB)")
         
         from google.cloud import speech_v1p1beta1 as speech
         
         client = get_speech_client()
-        audio_cfg = speech.RecognitionAudio(content=content)
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-            language_code="en-US",
-            enable_automatic_punctuation=True,
-            model="default",
-        )
+        config = _stt_config
+        
+        def recognize():
+            # Feed the upload in chunks rather than one buffered payload
+            requests = (
+                speech.StreamingRecognizeRequest(audio_content=chunk)
+                for chunk in iter(lambda: audio.file.read(STT_CHUNK_BYTES), b"")
+            )
+            return [
+                result.alternatives[0]
+                for resp in client.streaming_recognize(config=config, requests=requests)
+                for result in resp.results
+                if result.is_final and result.alternatives
+            ]
+        
+        if not stt_breaker.allow_request():
+            raise APIError(
+                status_code=503,
+                error_code="service_unavailable",
+                message="Speech recognition temporarily unavailable. Please try again in a moment."
+            )
         
-        resp = client.recognize(config=config, audio=audio_cfg)
+        # gRPC streaming is blocking; keep it off the event loop
+        try:
+            alternatives = await asyncio.to_thread(recognize)
+        except _GOOGLE_OUTAGE_ERRORS:
+            stt_breaker.record_failure()
+            raise
+        except ClientError:
+            stt_breaker.record_success()
+            raise
+        except BaseException:
+            # Not a verdict on the service (or cancelled); free the probe
+            stt_breaker.release_probe()
+            raise
+        stt_breaker.record_success()
         
-        if not resp.results:
+        if not alternatives:
             logger.info("STT: No speech detected")
             return {"text": ""}
         
-        transcript = resp.results[0].alternatives[0].transcript
-        confidence = resp.results[0].alternatives[0].confidence
+        transcript = " ".join(alt.transcript.strip() for alt in alternatives)
+        confidence = alternatives[0].confidence
         
         logger.info(f"🎙️ Transcribed ({confidence:.0%}): {transcript[:50]}...")
         return {"text": transcript, "confidence": confidence}
         
-    except HTTPException:
+    except (HTTPException, APIError):
         raise
     except Exception as e:
-        logger.error(f"STT error: {e}", exc_info=True)
-        return JSONResponse(
+        log_error("STT error", e)
+        return ORJSONResponse(
             status_code=500,
             content={"text": "", "error": "transcription_failed", "detail": str(e)}
         )
@@ -761,66 +1705,133 @@ async def speech_to_text(
 # TEXT-TO-SPEECH ENDPOINT WITH RETRY
 # =====================================================
 
+from cachetools import LRUCache
+
+ELEVENLABS_TTS_MODEL = "eleven_multilingual_v2"
+
+# Synthesized audio for recently requested text, so repeated phrases skip
+# the provider round trip. Bounded by total bytes, not entry count.
+TTS_CACHE_BYTES = int(os.getenv("TTS_CACHE_BYTES", str(64 * 1024 * 1024)))
+TTS_CACHE_MAX_ENTRY_BYTES = 2 * 1024 * 1024
+_tts_cache: LRUCache = LRUCache(maxsize=TTS_CACHE_BYTES, getsizeof=len)
+
+def _tts_cache_key(voice: str, model: str, text: str) -> str:
+    return hashlib.sha256(f"{voice}|{model}|{text}".encode()).hexdigest()
+
+def _cache_tts_audio(key: str, audio: bytes):
+    if len(audio) <= TTS_CACHE_MAX_ENTRY_BYTES:
+        _tts_cache[key] = audio
+
 @app.post("/v1/tts")
 async def text_to_speech(payload: TTSRequest):
     """Convert text to speech audio with fallback."""
     text = payload.text
     
+    eleven_key = _tts_cache_key(ELEVENLABS_VOICE_ID, ELEVENLABS_TTS_MODEL, text)
+    cached = _tts_cache.get(eleven_key)
+    if cached is not None:
+        return Response(content=cached, media_type="audio/mpeg")
+    
     # Try ElevenLabs first (with circuit breaker)
     if _eleven_client and elevenlabs_breaker.allow_request():
         try:
-            audio_stream = _eleven_client.text_to_speech.convert(
-                voice_id=ELEVENLABS_VOICE_ID,
-                model_id="eleven_multilingual_v2",
-                text=text,
-                output_format="mp3_44100_128",
-            )
+            def start_stream():
+                audio_stream = iter(_eleven_client.text_to_speech.convert(
+                    voice_id=ELEVENLABS_VOICE_ID,
+                    model_id=ELEVENLABS_TTS_MODEL,
+                    text=text,
+                    output_format="mp3_44100_128",
+                ))
+                return audio_stream, next(audio_stream, b"")
             
-            audio_bytes = b"".join(chunk for chunk in audio_stream)
+            # The ElevenLabs SDK is blocking; keep it off the event loop.
+            # Pull the first chunk before responding so a failed request
+            # still falls back to Google TTS.
+            # The slot bounds concurrent synthesis requests; once audio is
+            # flowing the rest is just reading an open response.
+            async with elevenlabs_bulkhead.slot():
+                audio_stream, first_chunk = await asyncio.to_thread(start_stream)
             elevenlabs_breaker.record_success()
-            logger.info(f"🔊 ElevenLabs TTS: {len(audio_bytes)} bytes")
             
-            return StreamingResponse(
-                io.BytesIO(audio_bytes),
-                media_type="audio/mpeg",
-                headers={"Content-Length": str(len(audio_bytes))}
-            )
+            async def relay():
+                total = len(first_chunk)
+                # Keep a copy for the cache unless the audio gets too big
+                chunks = [first_chunk]
+                yield first_chunk
+                try:
+                    while (chunk := await asyncio.to_thread(next, audio_stream, None)) is not None:
+                        total += len(chunk)
+                        if total > TTS_CACHE_MAX_ENTRY_BYTES:
+                            chunks = None
+                        elif chunks is not None:
+                            chunks.append(chunk)
+                        yield chunk
+                except Exception as e:
+                    elevenlabs_breaker.record_failure()
+                    logger.warning(f"ElevenLabs stream interrupted after {total} bytes: {e}")
+                    raise
+                if chunks is not None:
+                    _cache_tts_audio(eleven_key, b"".join(chunks))
+                logger.info(f"🔊 ElevenLabs TTS: {total} bytes")
+            
+            return StreamingResponse(relay(), media_type="audio/mpeg")
             
+        except BulkheadFull:
+            elevenlabs_breaker.release_probe()
+            logger.warning("ElevenLabs at capacity, using fallback")
         except Exception as e:
             elevenlabs_breaker.record_failure()
             logger.warning(f"ElevenLabs failed, using fallback: {e}")
     
     # Google TTS fallback
+    google_key = _tts_cache_key("google", "en-US-neutral", text)
+    cached = _tts_cache.get(google_key)
+    if cached is not None:
+        return Response(content=cached, media_type="audio/mpeg")
+    
+    if not google_tts_breaker.allow_request():
+        raise APIError(
+            status_code=503,
+            error_code="service_unavailable",
+            message="Speech synthesis temporarily unavailable. Please try again in a moment."
+        )
+    
     try:
         from google.cloud import texttospeech
         
         tts_client = get_tts_client()
         synthesis_input = texttospeech.SynthesisInput(text=text)
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="en-US",
-            ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL,
-        )
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
-        )
         
-        tts_resp = tts_client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
-        )
+        # Blocking gRPC call; keep it off the event loop
+        try:
+            tts_resp = await asyncio.to_thread(
+                tts_client.synthesize_speech,
+                input=synthesis_input,
+                voice=_tts_voice,
+                audio_config=_tts_audio_config
+            )
+        except _GOOGLE_OUTAGE_ERRORS:
+            google_tts_breaker.record_failure()
+            raise
+        except ClientError:
+            google_tts_breaker.record_success()
+            raise
+        except BaseException:
+            # Not a verdict on the service (or cancelled); free the probe
+            google_tts_breaker.release_probe()
+            raise
+        google_tts_breaker.record_success()
         
         audio_bytes = tts_resp.audio_content
+        _cache_tts_audio(google_key, audio_bytes)
         logger.info(f"🔊 Google TTS: {len(audio_bytes)} bytes")
         
-        return StreamingResponse(
-            io.BytesIO(audio_bytes),
-            media_type="audio/mpeg",
-            headers={"Content-Length": str(len(audio_bytes))}
-        )
+        # Already fully in memory; send it as one body (Content-Length is
+        # set from it) rather than re-chunking through a BytesIO
+        return Response(content=audio_bytes, media_type="audio/mpeg")
         
     except Exception as e:
-        logger.error(f"TTS error: {e}", exc_info=True)
+        log_error("TTS error", e)
         raise APIError(
             status_code=500,
             error_code="tts_error",
@@ -832,6 +1843,17 @@ async def text_to_speech(payload: TTSRequest):
 # TWILIO SMS WEBHOOK
 # =====================================================
 
+# TwiML is built from fixed bytes around the escaped message body
+_TWIML_PRE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+  <Message>Thanks for your message! Our AI assistant received: """
+_TWIML_POST = b"""</Message>
+</Response>"""
+_TWIML_ERROR = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+  <Message>Sorry, we couldn't process your message.</Message>
+</Response>"""
+
 @app.post("/twilio/sms")
 async def sms_webhook(request: Request):
     """Handle incoming SMS via Twilio webhook."""
@@ -842,22 +1864,14 @@ async def sms_webhook(request: Request):
         
         logger.info(f"📱 SMS from {from_number}: {body[:50]}...")
         
-        return HTMLResponse(
-            content=f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-  <Message>Thanks for your message! Our AI assistant received: {body}</Message>
-</Response>""",
+        # Escape so a body containing markup can't break the TwiML
+        return Response(
+            content=_TWIML_PRE + xml_escape(body).encode() + _TWIML_POST,
             media_type="application/xml",
         )
     except Exception as e:
         logger.error(f"SMS webhook error: {e}")
-        return HTMLResponse(
-            content="""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-  <Message>Sorry, we couldn't process your message.</Message>
-</Response>""",
-            media_type="application/xml",
-        )
+        return Response(content=_TWIML_ERROR, media_type="application/xml")
 
 # =====================================================
 # LIVEKIT TOKEN (Placeholder)
@@ -3,8 +3,12 @@ Conversation Management
 Handles context window limits, token counting, and message history.
 """
 
-import json
-from typing import List, Dict, Any, Optional
+import threading
+from bisect import bisect_left, bisect_right
+from collections import deque
+from functools import lru_cache
+from itertools import accumulate
+from typing import List, Dict, Any, Deque, Optional, Tuple
 from logging_config import get_logger
 
 logger = get_logger("mogul.conversation")
@@ -55,18 +59,40 @@ def estimate_tokens(text: str) -> int:
     return max(1, estimated)
 
 
+# Token counts for fixed prompts (e.g. the system prompt), keyed by text.
+# Filled once via cache_prompt_tokens() so every turn is a dict lookup.
+_prompt_token_cache: Dict[str, int] = {}
+
+
+def cache_prompt_tokens(text: str) -> int:
+    """Pre-count a fixed system prompt so later counts skip tokenizing it."""
+    tokens = 4 + estimate_tokens(text)
+    _prompt_token_cache[text] = tokens
+    return tokens
+
+
 def count_message_tokens(message: Dict[str, Any]) -> int:
     """
     Count tokens in a single message.
     
     Message format: {"role": "...", "content": "...", ...}
     """
+    content = message.get("content", "")
+    role = message.get("role")
+    
+    # Fast path: plain text without tool calls, which is nearly every message
+    if type(content) is str and role != "tool" and not message.get("tool_calls"):
+        if role == "system":
+            cached = _prompt_token_cache.get(content)
+            if cached is not None:
+                return cached
+        return 4 + _content_tokens(content)
+    
     tokens = 4  # Base overhead per message
     
     # Count content
-    content = message.get("content", "")
     if isinstance(content, str):
-        tokens += estimate_tokens(content)
+        tokens += _content_tokens(content)
     elif isinstance(content, list):
         # Multi-modal content (text + images)
         for part in content:
@@ -78,12 +104,12 @@ def count_message_tokens(message: Dict[str, Any]) -> int:
     
     # Count tool calls
     if "tool_calls" in message:
-        for tc in message.get("tool_calls", []):
+        for tc in message.get("tool_calls") or []:
             tokens += estimate_tokens(tc.get("function", {}).get("name", ""))
             tokens += estimate_tokens(tc.get("function", {}).get("arguments", ""))
     
     # Count function/tool response
-    if message.get("role") == "tool":
+    if role == "tool":
         tokens += estimate_tokens(message.get("content", ""))
     
     return tokens
@@ -91,48 +117,162 @@ def count_message_tokens(message: Dict[str, Any]) -> int:
 
 def count_messages_tokens(messages: List[Dict[str, Any]]) -> int:
     """Count total tokens in a message list."""
+    prime_token_cache(messages)
     total = 3  # Base overhead for message array
     for msg in messages:
         total += count_message_tokens(msg)
     return total
 
 
+def context_token_bound(messages: List[Dict[str, Any]]) -> Optional[int]:
+    """
+    Cheap upper bound on count_messages_tokens(), without encoding.
+    
+    Every token covers at least one UTF-8 byte, so the byte length of the
+    content can't undercount. Returns None when a message isn't plain text.
+    """
+    total = 3
+    for msg in messages:
+        content = msg.get("content")
+        if type(content) is not str or msg.get("role") == "tool" or msg.get("tool_calls"):
+            return None
+        total += 4 + len(content.encode())
+    return total
+
+
 # =====================================================
 # TRY TO USE TIKTOKEN IF AVAILABLE
 # =====================================================
 
+BATCH_ENCODE_MIN = 8
+BATCH_ENCODE_THREADS = 4
+
 try:
     import tiktoken
     
-    _encoders = {}
+    _estimate_tokens_chars = estimate_tokens
     
+    @lru_cache(maxsize=16)
     def get_encoder(model: str):
-        """Get or create tiktoken encoder for model."""
-        if model not in _encoders:
+        """
+        Get or create tiktoken encoder for model, or None if it can't be
+        loaded. The BPE ranks are downloaded on first use, which fails
+        offline; None is cached too, so that is only tried once.
+        """
+        try:
             try:
-                _encoders[model] = tiktoken.encoding_for_model(model)
+                return tiktoken.encoding_for_model(model)
             except KeyError:
                 # Fall back to cl100k_base for unknown models
-                _encoders[model] = tiktoken.get_encoding("cl100k_base")
-        return _encoders[model]
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken encoder for {model} unavailable, using estimated token counts: {e}")
+            return None
     
-    def estimate_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    # Loaded on first use rather than at import, so a failed download
+    # can't stop the app from starting
+    _DEFAULT_MODEL = "gpt-4o-mini"
+    
+    def estimate_tokens(text: str, model: str = _DEFAULT_MODEL) -> int:
         """Accurate token count using tiktoken."""
         if not text:
             return 0
         encoder = get_encoder(model)
+        if encoder is None:
+            return _estimate_tokens_chars(text)
         return len(encoder.encode(text))
     
+    def estimate_tokens_batch(texts: List[str]) -> List[int]:
+        """Accurate token counts for several strings, encoded in parallel."""
+        # encode_batch starts a thread pool per call; only worth it for
+        # more than a handful of texts
+        encoder = get_encoder(_DEFAULT_MODEL)
+        if encoder is None or len(texts) < BATCH_ENCODE_MIN:
+            return [estimate_tokens(text) for text in texts]
+        encoded = encoder.encode_batch(texts, num_threads=BATCH_ENCODE_THREADS)
+        return [len(tokens) for tokens in encoded]
+    
     logger.info("✅ Using tiktoken for accurate token counting")
     
 except ImportError:
+    def estimate_tokens_batch(texts: List[str]) -> List[int]:
+        """Estimate token counts for several strings."""
+        return [estimate_tokens(text) for text in texts]
+    
     logger.info("ℹ️ tiktoken not installed, using estimated token counts")
 
 
+# =====================================================
+# TOKEN COUNT CACHE
+# =====================================================
+
+# Clients resend the whole history every turn, so most message texts have
+# been counted before. Counts are cached by text (the dicts themselves go
+# to OpenAI and Firestore, so nothing is stored on them); the oldest entry
+# is evicted first once the cache is full. Batch preparation counts in a
+# worker thread, so writes (evict + insert) take a lock; reads don't need it.
+TOKEN_CACHE_SIZE = 4096
+_token_cache: Dict[str, int] = {}
+_token_cache_lock = threading.Lock()
+
+
+def _remember_tokens(text: str, tokens: int):
+    with _token_cache_lock:
+        if text not in _token_cache and len(_token_cache) >= TOKEN_CACHE_SIZE:
+            del _token_cache[next(iter(_token_cache))]
+        _token_cache[text] = tokens
+
+
+def _content_tokens(text: str) -> int:
+    tokens = _token_cache.get(text)
+    if tokens is None:
+        tokens = estimate_tokens(text)
+        _remember_tokens(text, tokens)
+    return tokens
+
+
+def prime_token_cache(messages: List[Dict[str, Any]]):
+    """Count all not-yet-cached message texts in one batch."""
+    missing = list(dict.fromkeys(
+        msg["content"] for msg in messages
+        if isinstance(msg.get("content"), str) and msg["content"] not in _token_cache
+    ))
+    if len(missing) < 2:
+        return  # Nothing to gain over counting on demand
+    for text, tokens in zip(missing, estimate_tokens_batch(missing)):
+        _remember_tokens(text, tokens)
+
+
 # =====================================================
 # CONTEXT WINDOW MANAGEMENT
 # =====================================================
 
+def _compact_tool_results(
+    messages: List[Dict[str, Any]],
+    msg_tokens: List[int],
+) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    Swap tool result payloads for a stub naming their size.
+    
+    Tool output is usually the bulk of a long history, while the user and
+    assistant turns around it carry the intent. Stubbing it keeps the
+    tool_call/tool pairing intact. Returns new (messages, msg_tokens) lists.
+    """
+    compacted = []
+    counts = []
+    for msg, n in zip(messages, msg_tokens):
+        if msg.get("role") == "tool":
+            msg = {**msg, "content": f"[tool result elided, {n} tokens]"}
+            n = count_message_tokens(msg)
+        compacted.append(msg)
+        counts.append(n)
+    return compacted, counts
+
+
+def _is_tool_result(msg: Dict[str, Any]) -> bool:
+    return msg.get("role") == "tool"
+
+
 def trim_conversation_history(
     messages: List[Dict[str, Any]],
     model: str = "gpt-4o-mini",
@@ -146,7 +286,9 @@ def trim_conversation_history(
     Strategy:
     1. Always keep system message (if preserve_system=True)
     2. Always keep most recent N messages (preserve_recent)
-    3. Remove oldest messages first until under limit
+    3. Replace older tool results with a short stub
+    4. Remove oldest messages first until under limit
+    5. Never separate tool results from the assistant message that called them
     
     Args:
         messages: List of message dicts
@@ -166,6 +308,13 @@ def trim_conversation_history(
         model_limit = MODEL_CONTEXT_LIMITS.get(model, 8192)
         max_tokens = model_limit - RESPONSE_TOKEN_RESERVE
     
+    # Most conversations are nowhere near the limit; a byte count is enough
+    # to tell, so the encoder only runs when trimming might happen.
+    # Anything that isn't plain text always takes the exact path.
+    bound = context_token_bound(messages)
+    if bound is not None and bound <= max_tokens:
+        return messages
+    
     # Separate system messages and others
     system_msgs = []
     other_msgs = []
@@ -184,12 +333,22 @@ def trim_conversation_history(
         logger.warning("System prompt exceeds available context")
         return system_msgs
     
+    # Count every message once; everything below works off these counts
+    prime_token_cache(other_msgs)
+    split = max(len(other_msgs) - preserve_recent, 0)
+    # Never cut between an assistant tool_calls message and its tool
+    # results (OpenAI rejects orphans): keep the whole group
+    while split > 0 and _is_tool_result(other_msgs[split]):
+        split -= 1
+    msg_tokens = [count_message_tokens(msg) for msg in other_msgs]
+    
     # Always keep the most recent messages
-    preserved = other_msgs[-preserve_recent:] if len(other_msgs) > preserve_recent else other_msgs[:]
-    older = other_msgs[:-preserve_recent] if len(other_msgs) > preserve_recent else []
+    preserved = other_msgs[split:]
+    older = other_msgs[:split]
+    older_tokens = msg_tokens[:split]
     
     # Calculate tokens for preserved messages
-    preserved_tokens = count_messages_tokens(preserved)
+    preserved_tokens = 3 + sum(msg_tokens[split:])
     
     # If preserved messages already exceed limit, we have a problem
     if preserved_tokens > available_tokens:
@@ -199,17 +358,20 @@ def trim_conversation_history(
         # Still return what we can
         return system_msgs + preserved
     
-    # Add older messages from most recent to oldest until we hit the limit
+    # Keep the longest run of newest older messages that fits: running
+    # totals from the newest backwards are non-decreasing, so bisect finds
+    # where they pass the budget
     remaining_tokens = available_tokens - preserved_tokens
-    kept_older = []
-    
-    for msg in reversed(older):
-        msg_tokens = count_message_tokens(msg)
-        if msg_tokens <= remaining_tokens:
-            kept_older.insert(0, msg)
-            remaining_tokens -= msg_tokens
-        else:
-            break  # Stop adding older messages
+    if sum(older_tokens) > remaining_tokens:
+        older, older_tokens = _compact_tool_results(older, older_tokens)
+    newest_first_totals = list(accumulate(reversed(older_tokens)))
+    keep = bisect_right(newest_first_totals, remaining_tokens)
+    start = len(older) - keep
+    # Same rule here, but the group's start didn't fit: drop its results too
+    while start < len(older) and _is_tool_result(older[start]):
+        start += 1
+    kept_older = older[start:]
+    remaining_tokens -= sum(older_tokens[start:])
     
     # Calculate how many messages we dropped
     dropped = len(older) - len(kept_older)
@@ -347,13 +509,16 @@ class ConversationBuffer:
         self.max_messages = max_messages
         self.max_tokens = max_tokens
         self.model = model
-        self._messages: List[Dict[str, Any]] = []
+        self._messages: Deque[Dict[str, Any]] = deque()
+        self._msg_tokens: Deque[int] = deque()  # Token count per message, same order
         self._token_count = 0
     
     def add(self, message: Dict[str, Any]):
         """Add a message to the buffer."""
+        tokens = count_message_tokens(message)
         self._messages.append(message)
-        self._token_count += count_message_tokens(message)
+        self._msg_tokens.append(tokens)
+        self._token_count += tokens
         
         # Auto-trim if needed
         self._trim_if_needed()
@@ -365,7 +530,7 @@ class ConversationBuffer:
     
     def get_messages(self) -> List[Dict[str, Any]]:
         """Get all messages in buffer."""
-        return self._messages.copy()
+        return list(self._messages)
     
     def get_for_completion(self, system_prompt: str = None) -> List[Dict[str, Any]]:
         """Get messages ready for API call, with optional system prompt."""
@@ -384,7 +549,8 @@ class ConversationBuffer:
     
     def clear(self):
         """Clear all messages."""
-        self._messages = []
+        self._messages.clear()
+        self._msg_tokens.clear()
         self._token_count = 0
     
     @property
@@ -399,12 +565,18 @@ class ConversationBuffer:
     
     def _trim_if_needed(self):
         """Trim buffer if exceeding limits."""
+        count = len(self._messages)
+        
         # Trim by message count
-        while len(self._messages) > self.max_messages:
-            removed = self._messages.pop(0)
-            self._token_count -= count_message_tokens(removed)
+        drop = max(count - self.max_messages, 0)
+        
+        # Trim by token count: the shortest prefix whose tokens cover the
+        # excess, always keeping the newest message
+        excess = self._token_count - self.max_tokens
+        if excess > 0:
+            prefix = list(accumulate(self._msg_tokens))
+            drop = max(drop, min(bisect_left(prefix, excess) + 1, count - 1))
         
-        # Trim by token count
-        while self._token_count > self.max_tokens and len(self._messages) > 1:
-            removed = self._messages.pop(0)
-            self._token_count -= count_message_tokens(removed)
\ No newline at end of file
+        for _ in range(drop):
+            self._messages.popleft()
+            self._token_count -= self._msg_tokens.popleft()
\ No newline at end of file
@@ -4,18 +4,70 @@ Prompt injection detection, content filtering, and input sanitization.
 """
 
 import re
+import threading
+from time import monotonic
+from collections import Counter, deque
 from typing import List, Dict, Any, Optional, Tuple
 from logging_config import get_logger
 
 logger = get_logger("mogul.guardrails")
 
+# Hyperscan is optional: when installed, the injection and sensitive-topic
+# patterns are compiled into one database and scanned in a single pass, and
+# the stdlib regexes only run for the patterns it reports. Without it, every
+# pattern is tried in turn.
+try:
+    import hyperscan
+    
+    _HS_FLAGS = (
+        hyperscan.HS_FLAG_CASELESS
+        | hyperscan.HS_FLAG_SINGLEMATCH
+        | hyperscan.HS_FLAG_UTF8
+        | hyperscan.HS_FLAG_UCP
+    )
+    
+    def _build_scanner(patterns: List[str]):
+        """Compile patterns into one Hyperscan database (ids = list index)."""
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[p.encode() for p in patterns],
+            ids=list(range(len(patterns))),
+            elements=len(patterns),
+            flags=[_HS_FLAGS] * len(patterns),
+        )
+        return db
+    
+    # Scratch space can't be shared between concurrent scans; one per thread
+    _thread_scratch = threading.local()
+    
+    def _scan(db, text: str) -> List[int]:
+        """Return the ids of all patterns matching text, in pattern order."""
+        scratch = getattr(_thread_scratch, "scratch", None)
+        if scratch is None:
+            scratch = _thread_scratch.scratch = hyperscan.Scratch(db)
+        
+        hits = set()
+        
+        def on_match(pattern_id, start, end, flags, context):
+            hits.add(pattern_id)
+        
+        db.scan(
+            text.encode("utf-8", "replace"),
+            match_event_handler=on_match,
+            scratch=scratch,
+        )
+        return sorted(hits)
+
+except ImportError:
+    hyperscan = None
+
 
 # =====================================================
 # PROMPT INJECTION DETECTION
 # =====================================================
 
 # Patterns that might indicate prompt injection attempts
-INJECTION_PATTERNS = [
+INJECTION_PATTERNS = (
     # Direct instruction overrides
     (r"ignore\s+(all\s+)?(previous|prior|above)\s+(instructions?|prompts?|rules?)", "instruction_override"),
     (r"disregard\s+(all\s+)?(previous|prior|above)", "instruction_override"),
@@ -48,30 +100,41 @@ INJECTION_PATTERNS = [
     (r"\[SYSTEM\]|\[INST\]|\[/INST\]", "delimiter_injection"),
     (r"<\|im_start\|>|<\|im_end\|>", "delimiter_injection"),
     (r"###\s*(system|instruction|human|assistant)", "delimiter_injection"),
-]
+)
 
-# Compile patterns for efficiency
-COMPILED_PATTERNS = [
-    (re.compile(pattern, re.IGNORECASE), category)
-    for pattern, category in INJECTION_PATTERNS
-]
+# Compiled once, as parallel tuples indexed by pattern id
+_INJECTION_REGEXES = tuple(re.compile(pattern, re.IGNORECASE) for pattern, _ in INJECTION_PATTERNS)
+_INJECTION_CATEGORIES = tuple(category for _, category in INJECTION_PATTERNS)
 
 
-def detect_prompt_injection(text: str) -> Tuple[bool, Optional[str], Optional[str]]:
+def detect_prompt_injection(
+    text: str,
+    hits: Optional[List[int]] = None,
+) -> Tuple[bool, Optional[str], Optional[str]]:
     """
     Check if text contains potential prompt injection attempts.
     
+    hits: result of _prescan(text), if the caller already has it.
+    
     Returns:
         Tuple of (is_suspicious, category, matched_pattern)
     """
     if not text:
         return False, None, None
     
-    text_lower = text.lower()
-    
-    for pattern, category in COMPILED_PATTERNS:
-        match = pattern.search(text_lower)
+    if hits is None:
+        hits = _prescan(text)
+    if hits is not None:
+        candidates = [i for i in hits if i < _N_INJECTION]
+    else:
+        candidates = range(_N_INJECTION)
+    
+    # Still run the regex on candidates: it supplies the matched text.
+    # Patterns are compiled with IGNORECASE; no lowered copy needed.
+    for i in candidates:
+        match = _INJECTION_REGEXES[i].search(text)
         if match:
+            category = _INJECTION_CATEGORIES[i]
             logger.warning(
                 f"Potential prompt injection detected",
                 extra={
@@ -121,10 +184,27 @@ DANGEROUS_PATTERNS = [
     (r'\t{5,}', '\t\t'),
 ]
 
-COMPILED_DANGEROUS = [
-    (re.compile(pattern), replacement)
-    for pattern, replacement in DANGEROUS_PATTERNS
-]
+# The patterns run in list order: stripping NUL or an ANSI sequence can
+# join the text around it into a new match for a later pattern, so those
+# two get a pass each. The whitespace collapses can't create matches for
+# one another, so they share one alternation (one group each, no nested
+# groups); m.lastindex says which pattern matched.
+_STRIP_PASSES = tuple((re.compile(pattern), replacement) for pattern, replacement in DANGEROUS_PATTERNS[:2])
+_COLLAPSE_RE = re.compile("|".join(f"({pattern})" for pattern, _ in DANGEROUS_PATTERNS[2:]))
+_COLLAPSE_REPLACEMENTS = tuple(replacement for _, replacement in DANGEROUS_PATTERNS[2:])
+
+
+def _collapse_replacement(match: re.Match) -> str:
+    return _COLLAPSE_REPLACEMENTS[match.lastindex - 1]
+
+
+# Every DANGEROUS_PATTERNS match contains one of these; keep them in sync.
+# Substring checks are memchr-speed, so clean text skips the regex entirely.
+_SANITIZE_TRIGGERS = ("\x00", "\x1b", "\n" * 5, " " * 10, "\t" * 5)
+
+
+def _needs_sanitizing(text: str) -> bool:
+    return any(trigger in text for trigger in _SANITIZE_TRIGGERS)
 
 
 def sanitize_input(text: str, max_length: int = 32000) -> str:
@@ -140,8 +220,10 @@ def sanitize_input(text: str, max_length: int = 32000) -> str:
     
     # Apply pattern replacements
     result = text
-    for pattern, replacement in COMPILED_DANGEROUS:
-        result = pattern.sub(replacement, result)
+    if _needs_sanitizing(text):
+        for pattern, replacement in _STRIP_PASSES:
+            result = pattern.sub(replacement, result)
+        result = _COLLAPSE_RE.sub(_collapse_replacement, result)
     
     # Truncate if too long
     if len(result) > max_length:
@@ -157,13 +239,19 @@ def sanitize_input(text: str, max_length: int = 32000) -> str:
 def sanitize_message(message: Dict[str, Any]) -> Dict[str, Any]:
     """
     Sanitize a message dict.
-    Returns a new dict with sanitized content.
+    Returns a new dict with sanitized content, or the message itself
+    when sanitizing changes nothing (the common case).
     """
-    sanitized = message.copy()
+    content = message.get("content")
+    if not isinstance(content, str):
+        return message
     
-    if "content" in sanitized and isinstance(sanitized["content"], str):
-        sanitized["content"] = sanitize_input(sanitized["content"])
+    cleaned = sanitize_input(content)
+    if cleaned == content:
+        return message
     
+    sanitized = message.copy()
+    sanitized["content"] = cleaned
     return sanitized
 
 
@@ -177,7 +265,7 @@ def sanitize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
 # =====================================================
 
 # Topics that should trigger caution
-SENSITIVE_TOPICS = [
+SENSITIVE_TOPICS = (
     # Self-harm related
     (r"\b(suicid|self.?harm|kill\s+(myself|yourself)|end\s+(my|your)\s+life)\b", "self_harm", "critical"),
     
@@ -189,18 +277,42 @@ SENSITIVE_TOPICS = [
     
     # PII requests (might be legitimate, just flag)
     (r"\b(social\s+security|ssn|credit\s+card\s+number|bank\s+account)\b", "pii_request", "medium"),
-]
+)
 
-COMPILED_SENSITIVE = [
-    (re.compile(pattern, re.IGNORECASE), topic, severity)
-    for pattern, topic, severity in SENSITIVE_TOPICS
-]
+_SEVERITY_SCORES = {"critical": 3, "high": 2, "medium": 1}
+
+# Compiled once, as parallel tuples indexed by pattern id
+_SENSITIVE_REGEXES = tuple(re.compile(pattern, re.IGNORECASE) for pattern, _, _ in SENSITIVE_TOPICS)
+_SENSITIVE_NAMES = tuple(topic for _, topic, _ in SENSITIVE_TOPICS)
+_SENSITIVE_SCORES = tuple(_SEVERITY_SCORES.get(severity, 0) for _, _, severity in SENSITIVE_TOPICS)
+
+# One database over both lists: injection ids first, then sensitive topics
+_N_INJECTION = len(INJECTION_PATTERNS)
+_SCANNER = (
+    _build_scanner(
+        [pattern for pattern, _ in INJECTION_PATTERNS]
+        + [pattern for pattern, _, _ in SENSITIVE_TOPICS]
+    )
+    if hyperscan else None
+)
 
 
-def check_content_safety(text: str) -> Tuple[str, Optional[str], List[str]]:
+def _prescan(text: str) -> Optional[List[int]]:
+    """Ids of all patterns matching text, or None without Hyperscan."""
+    if _SCANNER is None or not text:
+        return None
+    return _scan(_SCANNER, text)
+
+
+def check_content_safety(
+    text: str,
+    hits: Optional[List[int]] = None,
+) -> Tuple[str, Optional[str], List[str]]:
     """
     Check content for sensitive topics.
     
+    hits: result of _prescan(text), if the caller already has it.
+    
     Returns:
         Tuple of (safety_level, highest_severity_topic, all_flagged_topics)
         safety_level: "safe", "caution", "block"
@@ -210,16 +322,23 @@ def check_content_safety(text: str) -> Tuple[str, Optional[str], List[str]]:
     
     flagged = []
     highest_severity = None
-    severity_order = {"critical": 3, "high": 2, "medium": 1}
     max_severity_score = 0
     
-    for pattern, topic, severity in COMPILED_SENSITIVE:
-        if pattern.search(text):
-            flagged.append(topic)
-            score = severity_order.get(severity, 0)
-            if score > max_severity_score:
-                max_severity_score = score
-                highest_severity = topic
+    if hits is None:
+        hits = _prescan(text)
+    if hits is not None:
+        # Only the topic is needed, so a Hyperscan match is final
+        matched = [i - _N_INJECTION for i in hits if i >= _N_INJECTION]
+    else:
+        matched = [i for i, regex in enumerate(_SENSITIVE_REGEXES) if regex.search(text)]
+    
+    for i in matched:
+        topic = _SENSITIVE_NAMES[i]
+        flagged.append(topic)
+        score = _SENSITIVE_SCORES[i]
+        if score > max_severity_score:
+            max_severity_score = score
+            highest_severity = topic
     
     if not flagged:
         return "safe", None, []
@@ -300,6 +419,19 @@ def validate_tool_call(
 # RATE LIMIT ABUSE DETECTION
 # =====================================================
 
+class _UserActivity:
+    """Per-user window state for AbuseDetector."""
+    
+    __slots__ = ("hashes", "stamps", "counts", "injection_count", "last_cleanup")
+    
+    def __init__(self, now: float):
+        self.hashes: deque = deque()  # Message hashes, oldest first
+        self.stamps: deque = deque()  # Matching timestamps
+        self.counts: Counter = Counter()  # Hash -> occurrences in window
+        self.injection_count = 0
+        self.last_cleanup = now
+
+
 class AbuseDetector:
     """
     Detect potential abuse patterns.
@@ -321,7 +453,7 @@ class AbuseDetector:
         self.window_seconds = window_seconds
         
         # Track per-user patterns (user_id -> data)
-        self._user_data: Dict[str, Dict] = {}
+        self._user_data: Dict[str, _UserActivity] = {}
     
     def check_and_record(
         self,
@@ -335,34 +467,30 @@ class AbuseDetector:
         Returns:
             Tuple of (is_abusive, reason)
         """
-        import time
-        now = time.time()
+        now = monotonic()  # Immune to wall-clock jumps
         
         # Initialize user data if needed
-        if user_id not in self._user_data:
-            self._user_data[user_id] = {
-                "messages": [],
-                "injection_count": 0,
-                "last_cleanup": now,
-            }
+        data = self._user_data.get(user_id)
+        if data is None:
+            data = self._user_data[user_id] = _UserActivity(now)
         
-        data = self._user_data[user_id]
+        hashes, stamps, counts = data.hashes, data.stamps, data.counts
         
-        # Cleanup old data
-        if now - data["last_cleanup"] > self.window_seconds:
-            data["messages"] = [
-                (msg, ts) for msg, ts in data["messages"]
-                if now - ts < self.window_seconds
-            ]
-            data["injection_count"] = 0
-            data["last_cleanup"] = now
+        # Expire messages that left the window
+        while stamps and now - stamps[0] >= self.window_seconds:
+            stamps.popleft()
+            old_hash = hashes.popleft()
+            counts[old_hash] -= 1
+            if not counts[old_hash]:
+                del counts[old_hash]
+        
+        if now - data.last_cleanup > self.window_seconds:
+            data.injection_count = 0
+            data.last_cleanup = now
         
         # Check for duplicate messages
         msg_hash = hash(message[:500])  # Hash first 500 chars
-        duplicate_count = sum(
-            1 for msg, ts in data["messages"]
-            if msg == msg_hash and now - ts < self.window_seconds
-        )
+        duplicate_count = counts[msg_hash]
         
         if duplicate_count >= self.duplicate_threshold:
             logger.warning(
@@ -373,16 +501,18 @@ class AbuseDetector:
         
         # Record injection attempts
         if had_injection:
-            data["injection_count"] += 1
-            if data["injection_count"] >= self.injection_threshold:
+            data.injection_count += 1
+            if data.injection_count >= self.injection_threshold:
                 logger.warning(
                     f"Repeated injection attempts detected",
-                    extra={"user_id": user_id, "count": data["injection_count"]}
+                    extra={"user_id": user_id, "count": data.injection_count}
                 )
                 return True, "Too many suspicious requests"
         
         # Record this message
-        data["messages"].append((msg_hash, now))
+        hashes.append(msg_hash)
+        stamps.append(now)
+        counts[msg_hash] += 1
         
         return False, None
     
@@ -402,10 +532,15 @@ abuse_detector = AbuseDetector()
 def full_safety_check(
     messages: List[Dict[str, Any]],
     user_id: str = "anonymous",
+    record_abuse: bool = True,
 ) -> Tuple[bool, Optional[str], List[Dict[str, Any]]]:
     """
     Run full safety checks on incoming messages.
     
+    record_abuse=False skips the per-user abuse tracker, for offline input
+    (batches) that shouldn't count toward, or trip, live users' limits.
+    With nothing to escalate, an injection attempt then blocks outright.
+    
     Returns:
         Tuple of (is_safe, block_reason, sanitized_messages)
     """
@@ -417,19 +552,25 @@ def full_safety_check(
     latest_user_msg = user_messages[-1]
     content = latest_user_msg.get("content", "")
     
+    # One Hyperscan pass feeds both the injection and content checks
+    hits = _prescan(content)
+    
     # 1. Check for prompt injection
-    is_injection, injection_category, _ = detect_prompt_injection(content)
+    is_injection, injection_category, _ = detect_prompt_injection(content, hits)
     
     # 2. Check for abuse patterns
-    is_abuse, abuse_reason = abuse_detector.check_and_record(
-        user_id, content, had_injection=is_injection
-    )
-    
-    if is_abuse:
-        return False, abuse_reason, messages
+    if record_abuse:
+        is_abuse, abuse_reason = abuse_detector.check_and_record(
+            user_id, content, had_injection=is_injection
+        )
+        
+        if is_abuse:
+            return False, abuse_reason, messages
+    elif is_injection:
+        return False, f"Potential prompt injection ({injection_category})", messages
     
     # 3. Check content safety
-    safety_level, safety_topic, flagged_topics = check_content_safety(content)
+    safety_level, safety_topic, flagged_topics = check_content_safety(content, hits)
     
     if safety_level == "block":
         logger.warning(
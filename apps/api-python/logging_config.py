@@ -4,16 +4,30 @@ Provides JSON logging for production and pretty logging for development.
 """
 
 import logging
-import json
+import hashlib
 import sys
 import os
-from datetime import datetime
-from typing import Optional
-from contextvars import ContextVar
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict
+from contextvars import ContextVar, Token
 
-# Context variable for request tracking across async calls
-request_id_var: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
-user_id_var: ContextVar[Optional[str]] = ContextVar('user_id', default=None)
+import orjson
+
+# Request-scoped fields (request_id, user_id, ...) merged into every log
+# record. Bound once per request; formatters read it with a single lookup.
+# The dict is replaced on bind, never mutated in place.
+log_context_var: ContextVar[Dict[str, Any]] = ContextVar('log_context', default={})
+
+
+def bind_log_context(**fields) -> Token:
+    """
+    Add fields to the current request's log context.
+    
+    Returns a token that can be passed to log_context_var.reset().
+    """
+    return log_context_var.set({**log_context_var.get(), **fields})
 
 
 class JSONFormatter(logging.Formatter):
@@ -25,7 +39,7 @@ class JSONFormatter(logging.Formatter):
     
     def format(self, record: logging.LogRecord) -> str:
         log_obj = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -35,13 +49,9 @@ class JSONFormatter(logging.Formatter):
         }
         
         # Add request context if available
-        request_id = request_id_var.get()
-        if request_id:
-            log_obj["request_id"] = request_id
-            
-        user_id = user_id_var.get()
-        if user_id:
-            log_obj["user_id"] = user_id
+        context = log_context_var.get()
+        if context:
+            log_obj.update(context)
         
         # Add any extra fields passed to the logger
         if hasattr(record, 'extra_fields'):
@@ -55,7 +65,7 @@ class JSONFormatter(logging.Formatter):
                 "traceback": self.formatException(record.exc_info),
             }
         
-        return json.dumps(log_obj, default=str)
+        return orjson.dumps(log_obj, default=str, option=orjson.OPT_UTC_Z).decode()
 
 
 class PrettyFormatter(logging.Formatter):
@@ -72,18 +82,36 @@ class PrettyFormatter(logging.Formatter):
     }
     RESET = '\033[0m'
     
+    # "| LEVEL    <reset> |" part of each line, padded once per level
+    LABELS = {
+        level: f" | {level:8}\033[0m | "
+        for level in COLORS
+    }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._last_second = None
+        self._last_timestamp = ""
+    
     def format(self, record: logging.LogRecord) -> str:
-        color = self.COLORS.get(record.levelname, self.RESET)
+        levelname = record.levelname
+        color = self.COLORS.get(levelname, self.RESET)
+        label = self.LABELS.get(levelname) or f" | {levelname:8}{self.RESET} | "
         
         # Build prefix with request ID if available
-        request_id = request_id_var.get()
-        prefix = f"[{request_id[:8]}] " if request_id else ""
+        request_id = log_context_var.get().get("request_id")
+        prefix = "[%.8s] " % request_id if request_id else ""
         
-        # Format timestamp
-        timestamp = datetime.now().strftime('%H:%M:%S')
+        # Format timestamp from the record's own clock reading; it only
+        # changes once a second, so reuse the last one when we can
+        second = int(record.created)
+        if second != self._last_second:
+            self._last_second = second
+            self._last_timestamp = time.strftime('%H:%M:%S', time.localtime(second))
+        timestamp = self._last_timestamp
         
         # Build the log line
-        base = f"{color}{timestamp} | {record.levelname:8}{self.RESET} | {prefix}{record.getMessage()}"
+        base = "%s%s%s%s%s" % (color, timestamp, label, prefix, record.getMessage())
         
         # Add exception if present
         if record.exc_info:
@@ -98,22 +126,62 @@ class ContextLogger(logging.LoggerAdapter):
     """
     
     def process(self, msg, kwargs):
-        # Merge extra fields
-        extra = kwargs.get('extra', {})
-        
-        # Add request context
-        request_id = request_id_var.get()
-        if request_id:
-            extra['request_id'] = request_id
-            
-        user_id = user_id_var.get()
-        if user_id:
-            extra['user_id'] = user_id
+        context = log_context_var.get()
+        if not context:
+            return msg, kwargs
         
-        kwargs['extra'] = extra
+        # Merge request context into a copy so the caller's extra dict
+        # isn't modified
+        kwargs['extra'] = {**kwargs.get('extra', {}), **context}
         return msg, kwargs
 
 
+class BufferedStreamHandler(logging.StreamHandler):
+    """
+    StreamHandler that leaves flushing to the stream's own buffer.
+    
+    The stock handler flushes after every record, which is a write()
+    syscall per log line. Here records below flush_level just accumulate,
+    and a background thread flushes every flush_interval seconds so quiet
+    periods still reach the log collector promptly. close() stops that
+    thread; logging's own atexit shutdown calls it and flushes whatever
+    is left.
+    """
+    
+    def __init__(self, stream=None, flush_level: int = logging.WARNING, flush_interval: float = 1.0):
+        super().__init__(stream)
+        self.flush_level = flush_level
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically,
+            args=(flush_interval,),
+            name="log-flusher",
+            daemon=True,
+        )
+        self._flusher.start()
+    
+    def _flush_periodically(self, interval: float):
+        while not self._stop.wait(interval):
+            self.flush()
+    
+    def close(self):
+        self._stop.set()
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
+        super().close()
+    
+    def emit(self, record: logging.LogRecord):
+        try:
+            msg = self.format(record)
+            self.stream.write(msg + self.terminator)
+            if record.levelno >= self.flush_level:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
 def setup_logging(
     name: str = "mogul",
     level: str = None,
@@ -145,15 +213,18 @@ def setup_logging(
     logger = logging.getLogger(name)
     logger.setLevel(getattr(logging, level))
     
-    # Remove existing handlers
+    # Remove existing handlers (closing them stops any flusher threads)
+    for old_handler in logger.handlers:
+        old_handler.close()
     logger.handlers.clear()
     
-    # Create handler with appropriate formatter
-    handler = logging.StreamHandler(sys.stdout)
-    
+    # Create handler with appropriate formatter. Production output is
+    # buffered; local development keeps per-line flushing.
     if json_format:
+        handler = BufferedStreamHandler(sys.stdout)
         handler.setFormatter(JSONFormatter())
     else:
+        handler = logging.StreamHandler(sys.stdout)
         handler.setFormatter(PrettyFormatter())
     
     logger.addHandler(handler)
@@ -181,7 +252,12 @@ def log_with_context(
     
     Usage:
         log_with_context(logger, logging.INFO, "User action", action="login", user_id="123")
+    
+    makeRecord skips the logger's level check, so do it here before
+    building anything.
     """
+    if not logger.isEnabledFor(level):
+        return
     record = logger.makeRecord(
         logger.name,
         level,
@@ -192,4 +268,14 @@ def log_with_context(
         None
     )
     record.extra_fields = extra_fields
-    logger.handle(record)
\ No newline at end of file
+    logger.handle(record)
+
+def error_fingerprint(exc: BaseException) -> str:
+    """
+    Short stable hash of an exception's type and first argument.
+    
+    Lets log aggregators group recurring errors without shipping tracebacks.
+    """
+    first_arg = exc.args[0] if exc.args else ""
+    key = f"{type(exc).__name__}:{first_arg}"
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
@@ -4,29 +4,49 @@ Includes: Request Tracing, Rate Limiting, Authentication
 """
 
 import os
+import base64
+import logging
+import math
 import time
 import hashlib
+import heapq
 import hmac
+import itertools
 import secrets
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Callable, Tuple
-from collections import defaultdict
-import asyncio
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple
 
-from fastapi import Request, HTTPException, status
+import orjson
+from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from logging_config import request_id_var, user_id_var, get_logger
+from logging_config import log_context_var, bind_log_context, get_logger, error_fingerprint
 
 logger = get_logger("mogul.middleware")
 
 
+# Static UI mount; skipped by rate limiting and auth
+STATIC_PREFIX = "/ui"
+
+
 # =====================================================
 # REQUEST TRACING MIDDLEWARE
 # =====================================================
 
-class RequestTracingMiddleware(BaseHTTPMiddleware):
+# Request IDs are a per-process counter followed by a worker tag (pid plus
+# random bits, so restarts and other hosts differ). The counter comes
+# first so the short 8-char form in dev logs still tells requests apart.
+_request_counter = itertools.count(secrets.randbits(32))
+_request_id_suffix = f"{os.getpid() & 0xffff:04x}{secrets.randbits(16):04x}"
+
+
+def _new_request_id() -> str:
+    return f"{next(_request_counter) & 0xffffffff:08x}{_request_id_suffix}"
+
+
+class RequestTracingMiddleware:
     """
     Adds unique request ID to every request for tracing.
     - Generates a unique ID for each request
@@ -34,75 +54,102 @@ class RequestTracingMiddleware(BaseHTTPMiddleware):
     - Makes it available via context var for logging
     """
     
-    async def dispatch(self, request: Request, call_next):
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
         # Generate or extract request ID
-        request_id = request.headers.get("X-Request-ID")
+        headers = Headers(scope=scope)
+        request_id = headers.get("X-Request-ID")
         if not request_id:
-            request_id = secrets.token_hex(8)
+            request_id = _new_request_id()
         
         # Store in context var for logging
-        token = request_id_var.set(request_id)
+        token = bind_log_context(request_id=request_id)
         
-        # Store on request state for handlers
-        request.state.request_id = request_id
+        # Store on request state for handlers and the inner middlewares
+        client_ip = _get_client_ip(scope, headers)
+        state = scope.setdefault("state", {})
+        state["request_id"] = request_id
+        state["client_ip"] = client_ip
         
         # Log request start
-        start_time = time.perf_counter()
-        logger.info(
-            f"→ {request.method} {request.url.path}",
-            extra={
-                "event": "request_started",
-                "method": request.method,
-                "path": request.url.path,
-                "query": str(request.query_params),
-                "client_ip": self._get_client_ip(request),
-            }
-        )
+        start_ns = time.monotonic_ns()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "→ %s %s", scope["method"], scope["path"],
+                extra={
+                    "event": "request_started",
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope["query_string"].decode("latin-1"),
+                    "client_ip": client_ip,
+                }
+            )
+        
+        status_code = None
+        
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                duration_ms = (time.monotonic_ns() - start_ns) // 1_000_000
+                
+                # Add headers
+                response_headers = MutableHeaders(scope=message)
+                response_headers["X-Request-ID"] = request_id
+                response_headers["X-Response-Time"] = f"{duration_ms}ms"
+            await send(message)
         
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
             
             # Calculate duration
-            duration_ms = (time.perf_counter() - start_time) * 1000
-            
-            # Add headers
-            response.headers["X-Request-ID"] = request_id
-            response.headers["X-Response-Time"] = f"{duration_ms:.2f}ms"
+            duration_ms = _elapsed_ms(start_ns)
             
             # Log request completion
-            logger.info(
-                f"← {response.status_code} ({duration_ms:.0f}ms)",
-                extra={
-                    "event": "request_completed",
-                    "status_code": response.status_code,
-                    "duration_ms": round(duration_ms, 2),
-                }
-            )
-            
-            return response
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "← %s (%.0fms)", status_code, duration_ms,
+                    extra={
+                        "event": "request_completed",
+                        "status_code": status_code,
+                        "duration_ms": duration_ms,
+                    }
+                )
             
         except Exception as e:
-            duration_ms = (time.perf_counter() - start_time) * 1000
+            duration_ms = _elapsed_ms(start_ns)
             logger.error(
-                f"✗ Request failed: {e}",
+                "✗ Request failed: %s", e,
                 extra={
                     "event": "request_failed",
                     "error": str(e),
-                    "duration_ms": round(duration_ms, 2),
+                    "error_fingerprint": error_fingerprint(e),
+                    "duration_ms": duration_ms,
                 },
-                exc_info=True
             )
             raise
             
         finally:
-            request_id_var.reset(token)
-    
-    def _get_client_ip(self, request: Request) -> str:
-        """Extract client IP, handling proxies."""
-        forwarded = request.headers.get("X-Forwarded-For")
-        if forwarded:
-            return forwarded.split(",")[0].strip()
-        return request.client.host if request.client else "unknown"
+            log_context_var.reset(token)
+
+
+def _elapsed_ms(start_ns: int) -> float:
+    """Milliseconds since start_ns, kept to two decimals for the logs."""
+    return (time.monotonic_ns() - start_ns) // 10_000 / 100
+
+
+def _get_client_ip(scope: Scope, headers: Headers) -> str:
+    """Extract client IP, handling proxies."""
+    forwarded = headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
 
 
 # =====================================================
@@ -111,7 +158,11 @@ class RequestTracingMiddleware(BaseHTTPMiddleware):
 
 class RateLimiter:
     """
-    In-memory sliding window rate limiter.
+    In-memory token bucket rate limiter.
+    
+    Each key holds (tokens, last_refill_ns). Buckets start full at `limit`
+    and refill at limit / window_seconds per second, so a key gets
+    `limit` requests per window on average with no per-request history.
     
     For production, replace with Redis-based implementation:
     - Use Redis MULTI/EXEC for atomic operations
@@ -119,8 +170,10 @@ class RateLimiter:
     """
     
     def __init__(self):
-        self._requests: Dict[str, list] = defaultdict(list)
-        self._lock = asyncio.Lock()
+        # No lock: nothing below awaits, so each check runs to completion
+        # on the event loop without interleaving. Ordered by last access,
+        # least recent first, so cleanup only looks at stale entries.
+        self._buckets: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
     
     async def is_allowed(
         self,
@@ -139,58 +192,52 @@ class RateLimiter:
         Returns:
             Tuple of (is_allowed, rate_limit_info)
         """
-        now = time.time()
-        window_start = now - window_seconds
-        
-        async with self._lock:
-            # Clean old requests
-            self._requests[key] = [
-                ts for ts in self._requests[key]
-                if ts > window_start
-            ]
-            
-            current_count = len(self._requests[key])
-            
-            if current_count >= limit:
-                # Calculate retry after
-                oldest = min(self._requests[key]) if self._requests[key] else now
-                retry_after = int(oldest + window_seconds - now) + 1
-                
-                return False, {
-                    "limit": limit,
-                    "remaining": 0,
-                    "reset": int(oldest + window_seconds),
-                    "retry_after": retry_after,
-                }
-            
-            # Add this request
-            self._requests[key].append(now)
-            
-            return True, {
+        now = time.monotonic_ns()
+        rate = limit / window_seconds
+        
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = float(limit)
+        else:
+            # Elapsed time stays an exact integer; only the refill is float
+            tokens, last = bucket
+            tokens = min(limit, tokens + (now - last) * limit / (window_seconds * 1_000_000_000))
+        
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        
+        wall_now = time.time()
+        if not allowed:
+            retry_after = math.ceil((1 - tokens) / rate)
+            return False, {
                 "limit": limit,
-                "remaining": limit - current_count - 1,
-                "reset": int(now + window_seconds),
+                "remaining": 0,
+                "reset": int(wall_now + retry_after),
+                "retry_after": retry_after,
             }
+        
+        return True, {
+            "limit": limit,
+            "remaining": int(tokens),
+            "reset": int(wall_now + (limit - tokens) / rate),
+        }
     
     async def cleanup(self):
-        """Remove expired entries to prevent memory growth."""
-        now = time.time()
-        async with self._lock:
-            expired_keys = []
-            for key, timestamps in self._requests.items():
-                # If all timestamps are old, mark for removal
-                if all(ts < now - 3600 for ts in timestamps):  # 1 hour old
-                    expired_keys.append(key)
-            
-            for key in expired_keys:
-                del self._requests[key]
+        """Remove idle buckets to prevent memory growth."""
+        cutoff = time.monotonic_ns() - 3600 * 1_000_000_000  # 1 hour idle
+        buckets = self._buckets
+        while buckets and next(iter(buckets.values()))[1] < cutoff:
+            buckets.popitem(last=False)
 
 
 # Global rate limiter instance
 rate_limiter = RateLimiter()
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+class RateLimitMiddleware:
     """
     Rate limiting middleware with configurable limits per endpoint.
     """
@@ -198,35 +245,56 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
     # Rate limits: (requests, seconds)
     LIMITS = {
         "/v1/chat": (30, 60),       # 30 requests per minute
+        "/v1/chat/batch": (5, 60),  # 5 batch submissions per minute
         "/v1/stt": (20, 60),        # 20 transcriptions per minute
         "/v1/tts": (20, 60),        # 20 TTS requests per minute
         "default": (100, 60),       # 100 requests per minute default
     }
     
+    # Routes that draw from another route's bucket. Streaming chat makes
+    # the same OpenAI calls as /v1/chat, so the two share one limit.
+    SHARED_BUCKETS = {
+        "/v1/chat/stream": "/v1/chat",
+    }
+    
     # Paths to skip rate limiting
-    SKIP_PATHS = {"/healthz", "/favicon.ico", "/"}
+    SKIP_PATHS = frozenset({"/healthz", "/favicon.ico", "/"})
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # The limit header value is fixed per endpoint, so encode it once
+        self._limit_headers = {
+            path: (b"x-ratelimit-limit", str(limit).encode())
+            for path, (limit, _) in self.LIMITS.items()
+        }
     
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        path = scope["path"]
         
         # Skip rate limiting for certain paths
-        if path in self.SKIP_PATHS or path.startswith("/ui"):
-            return await call_next(request)
+        if path in self.SKIP_PATHS or path.startswith(STATIC_PREFIX):
+            return await self.app(scope, receive, send)
         
         # Get rate limit for this endpoint
-        limit, window = self.LIMITS.get(path, self.LIMITS["default"])
+        bucket = self.SHARED_BUCKETS.get(path, path)
+        limit_key = bucket if bucket in self.LIMITS else "default"
+        limit, window = self.LIMITS[limit_key]
         
         # Create rate limit key (IP-based, or user-based if authenticated)
-        client_ip = self._get_client_ip(request)
-        user_id = getattr(request.state, "user_id", None)
-        key = f"{user_id or client_ip}:{path}"
+        state = scope.get("state", {})
+        client_ip = state.get("client_ip") or _get_client_ip(scope, Headers(scope=scope))
+        user_id = state.get("user_id")
+        key = f"{user_id or client_ip}:{bucket}"
         
         # Check rate limit
         allowed, info = await rate_limiter.is_allowed(key, limit, window)
         
         if not allowed:
             logger.warning(
-                f"Rate limit exceeded for {key}",
+                "Rate limit exceeded for %s", key,
                 extra={
                     "event": "rate_limit_exceeded",
                     "key": key,
@@ -234,7 +302,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
                 }
             )
             
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=429,
                 content={
                     "error": "rate_limit_exceeded",
@@ -248,22 +316,20 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
                     "Retry-After": str(info["retry_after"]),
                 }
             )
+            return await response(scope, receive, send)
+        
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                # Add rate limit headers
+                message.setdefault("headers", []).extend((
+                    self._limit_headers[limit_key],
+                    (b"x-ratelimit-remaining", b"%d" % info["remaining"]),
+                    (b"x-ratelimit-reset", b"%d" % info["reset"]),
+                ))
+            await send(message)
         
         # Process request
-        response = await call_next(request)
-        
-        # Add rate limit headers
-        response.headers["X-RateLimit-Limit"] = str(info["limit"])
-        response.headers["X-RateLimit-Remaining"] = str(info["remaining"])
-        response.headers["X-RateLimit-Reset"] = str(info["reset"])
-        
-        return response
-    
-    def _get_client_ip(self, request: Request) -> str:
-        forwarded = request.headers.get("X-Forwarded-For")
-        if forwarded:
-            return forwarded.split(",")[0].strip()
-        return request.client.host if request.client else "unknown"
+        await self.app(scope, receive, send_wrapper)
 
 
 # =====================================================
@@ -272,7 +338,16 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
 
 class SessionAuth:
     """
-    Simple session-based authentication.
+    Stateless signed session tokens.
+    
+    A token is base64url(JSON payload) + "." + keyed BLAKE2b MAC of that
+    payload, so any worker holding SESSION_SECRET can validate it without
+    a shared store. Only explicitly invalidated tokens are remembered,
+    until they would have expired anyway.
+    
+    Revocation is per-process: a token invalidated on one worker stays
+    valid on the others (and after a restart) until it expires. Use a
+    short SESSION_TTL or a shared store if that matters.
     
     For production, consider:
     - JWT tokens with proper signing
@@ -280,57 +355,94 @@ class SessionAuth:
     - Integration with Auth0, Firebase Auth, etc.
     """
     
+    SESSION_TTL = 7 * 24 * 3600  # 7 days
+    
     def __init__(self, secret_key: str = None):
         self.secret_key = secret_key or os.getenv("SESSION_SECRET", "")
         if not self.secret_key:
             logger.warning("⚠️ SESSION_SECRET not set - auth disabled in development")
         
-        # In-memory session store (use Redis in production)
-        self._sessions: Dict[str, dict] = {}
+        # BLAKE2b takes up to 64 key bytes; hash the secret down to that
+        # rather than truncating it, so every byte of it counts. Without a
+        # secret, fall back to a per-process random key so tokens at least
+        # can't be forged.
+        if self.secret_key:
+            self._key_bytes = hashlib.blake2b(self.secret_key.encode()).digest()
+        else:
+            self._key_bytes = secrets.token_bytes(32)
+        
+        # Revoked tokens -> expiry, plus an (expires_at, token) min-heap so
+        # entries are dropped once the token would be invalid anyway
+        self._revoked: Dict[str, float] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+    
+    def _sign(self, payload: bytes) -> bytes:
+        return hashlib.blake2b(payload, key=self._key_bytes, digest_size=16).hexdigest().encode()
     
     def create_session(self, user_id: str, metadata: dict = None) -> str:
         """Create a new session token."""
-        token = secrets.token_urlsafe(32)
-        
-        self._sessions[token] = {
+        now = time.time()
+        session = {
             "user_id": user_id,
-            "created_at": datetime.utcnow().isoformat(),
-            "expires_at": (datetime.utcnow() + timedelta(days=7)).isoformat(),
+            "created_at": now,
+            "expires_at": now + self.SESSION_TTL,
             "metadata": metadata or {},
         }
+        payload = base64.urlsafe_b64encode(orjson.dumps(session))
         
-        return token
+        return (payload + b"." + self._sign(payload)).decode()
     
     def validate_session(self, token: str) -> Optional[dict]:
         """Validate a session token and return session data."""
         if not token:
             return None
         
-        session = self._sessions.get(token)
-        if not session:
+        payload, _, signature = token.rpartition(".")
+        if not payload:
+            return None
+        
+        payload_bytes = payload.encode()
+        if not hmac.compare_digest(signature.encode(), self._sign(payload_bytes)):
+            return None
+        
+        if token in self._revoked:
+            return None
+        
+        try:
+            session = orjson.loads(base64.urlsafe_b64decode(payload_bytes))
+        except ValueError:
             return None
         
         # Check expiration
-        expires_at = datetime.fromisoformat(session["expires_at"])
-        if datetime.utcnow() > expires_at:
-            del self._sessions[token]
+        if time.time() > session["expires_at"]:
             return None
         
         return session
     
     def invalidate_session(self, token: str):
         """Invalidate a session token."""
-        self._sessions.pop(token, None)
+        session = self.validate_session(token)
+        if not session:
+            return
+        
+        self._revoked[token] = session["expires_at"]
+        heapq.heappush(self._expiry_heap, (session["expires_at"], token))
+        self._purge_expired(time.time())
+    
+    def _purge_expired(self, now: float):
+        """Forget revocations for tokens that have expired, oldest first."""
+        heap = self._expiry_heap
+        while heap and heap[0][0] < now:
+            _, token = heapq.heappop(heap)
+            self._revoked.pop(token, None)
     
     def generate_api_key(self, user_id: str) -> str:
         """Generate an API key for programmatic access."""
         # Create a deterministic but secure key
         payload = f"{user_id}:{secrets.token_hex(16)}"
-        signature = hmac.new(
-            self.secret_key.encode(),
-            payload.encode(),
-            hashlib.sha256
-        ).hexdigest()[:16]
+        signature = hashlib.blake2b(
+            payload.encode(), key=self._key_bytes, digest_size=8
+        ).hexdigest()
         
         return f"mda_{signature}_{secrets.token_hex(8)}"
 
@@ -339,7 +451,7 @@ class SessionAuth:
 session_auth = SessionAuth()
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
+class AuthMiddleware:
     """
     Authentication middleware.
     
@@ -350,34 +462,39 @@ class AuthMiddleware(BaseHTTPMiddleware):
     """
     
     # Paths that don't require authentication
-    PUBLIC_PATHS = {
+    PUBLIC_PATHS = frozenset({
         "/",
         "/healthz",
         "/config",
         "/favicon.ico",
         "/twilio/sms",  # Twilio validates via signature
-    }
+    })
     
-    def __init__(self, app, require_auth: bool = None):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, require_auth: bool = None):
+        self.app = app
         # Default: require auth in production only
         if require_auth is None:
             require_auth = os.getenv("REQUIRE_AUTH", "false").lower() == "true"
         self.require_auth = require_auth
     
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        path = scope["path"]
         
         # Skip auth for public paths and static files
-        if path in self.PUBLIC_PATHS or path.startswith("/ui"):
-            return await call_next(request)
+        if path in self.PUBLIC_PATHS or path.startswith(STATIC_PREFIX):
+            return await self.app(scope, receive, send)
+        
+        headers = Headers(scope=scope)
         
         # Try to authenticate
         user_id = None
         auth_method = None
         
         # Check for session token
-        session_token = request.headers.get("X-Session-Token")
+        session_token = headers.get("X-Session-Token")
         if session_token:
             session = session_auth.validate_session(session_token)
             if session:
@@ -386,7 +503,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
         
         # Check for API key
         if not user_id:
-            auth_header = request.headers.get("Authorization", "")
+            auth_header = headers.get("Authorization", "")
             if auth_header.startswith("Bearer mda_"):
                 api_key = auth_header[7:]  # Remove "Bearer "
                 # In production, validate against stored API keys
@@ -396,57 +513,80 @@ class AuthMiddleware(BaseHTTPMiddleware):
                     auth_method = "api_key"
         
         # Store auth info on request
-        request.state.user_id = user_id
-        request.state.auth_method = auth_method
+        state = scope.setdefault("state", {})
+        state["user_id"] = user_id
+        state["auth_method"] = auth_method
         
         # Set context var for logging
         if user_id:
-            user_id_var.set(user_id)
+            bind_log_context(user_id=user_id)
         
         # Require auth if enabled
         if self.require_auth and not user_id:
             logger.warning(
-                f"Unauthorized request to {path}",
+                "Unauthorized request to %s", path,
                 extra={"event": "auth_failed", "path": path}
             )
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=401,
                 content={
                     "error": "unauthorized",
                     "message": "Authentication required",
                 }
             )
+            return await response(scope, receive, send)
         
-        return await call_next(request)
+        await self.app(scope, receive, send)
 
 
 # =====================================================
 # SECURITY HEADERS MIDDLEWARE
 # =====================================================
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+# Built once; appended to the raw ASGI header list of every response
+_SECURITY_HEADERS = (
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+)
+
+_CSP_HEADER = (
+    b"content-security-policy",
+    b"default-src 'self'; "
+    b"script-src 'self' 'unsafe-inline'; "
+    b"style-src 'self' 'unsafe-inline' https://fonts.googleapis.com; "
+    b"font-src 'self' https://fonts.gstatic.com; "
+    b"img-src 'self' data: https:; "
+    b"media-src 'self' blob:; "
+    b"connect-src 'self' https://api.cal.com https://cal.com; "
+    b"frame-src https://cal.com;",
+)
+
+
+class SecurityHeadersMiddleware:
     """Add security headers to all responses."""
     
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        
-        # Security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        
-        # Only add CSP for HTML responses
-        if "text/html" in response.headers.get("content-type", ""):
-            response.headers["Content-Security-Policy"] = (
-                "default-src 'self'; "
-                "script-src 'self' 'unsafe-inline'; "
-                "style-src 'self' 'unsafe-inline' https://fonts.googleapis.com; "
-                "font-src 'self' https://fonts.gstatic.com; "
-                "img-src 'self' data: https:; "
-                "media-src 'self' blob:; "
-                "connect-src 'self' https://api.cal.com https://cal.com; "
-                "frame-src https://cal.com;"
-            )
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                headers = message.setdefault("headers", [])
+                
+                # Only add CSP for HTML responses
+                is_html = any(
+                    name == b"content-type" and b"text/html" in value
+                    for name, value in headers
+                )
+                
+                headers.extend(_SECURITY_HEADERS)
+                if is_html:
+                    headers.append(_CSP_HEADER)
+            await send(message)
         
-        return response
\ No newline at end of file
+        await self.app(scope, receive, send_wrapper)
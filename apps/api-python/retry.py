@@ -4,13 +4,24 @@ Handles transient failures with exponential backoff.
 """
 
 import asyncio
+import logging
 import random
+import time
+from contextlib import asynccontextmanager
 from functools import wraps
-from typing import Tuple, Type, Callable, Any
+from typing import Tuple, Type, Callable, Any, Literal, Optional
 from logging_config import get_logger
 
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
 logger = get_logger("mogul.retry")
 
+# Breaker timing only needs intervals, so use a clock that can't jump
+_monotonic = time.monotonic
+
 
 class RetryExhausted(Exception):
     """Raised when all retry attempts have been exhausted."""
@@ -20,6 +31,29 @@ class RetryExhausted(Exception):
         super().__init__(f"Failed after {attempts} attempts: {last_exception}")
 
 
+JitterMode = Literal["none", "equal", "full"]
+
+
+def _make_jitter(jitter: bool, jitter_mode: JitterMode) -> Callable[[float], float]:
+    """
+    Return a function mapping a backoff delay to the delay actually slept.
+    
+    - full:  uniform in [0, delay]
+    - equal: uniform in [delay/2, delay]
+    - none:  delay unchanged (also when jitter=False)
+    """
+    if not jitter or jitter_mode == "none":
+        return lambda delay: delay
+    
+    # Own generator per decorated function, independent of the global one
+    rng = random.Random()
+    if jitter_mode == "full":
+        return lambda delay: rng.random() * delay
+    if jitter_mode == "equal":
+        return lambda delay: delay * (0.5 + rng.random() * 0.5)
+    raise ValueError(f"Unknown jitter_mode: {jitter_mode}")
+
+
 def with_retry(
     max_attempts: int = 3,
     base_delay: float = 1.0,
@@ -28,6 +62,7 @@ def with_retry(
     jitter: bool = True,
     exceptions: Tuple[Type[Exception], ...] = (Exception,),
     on_retry: Callable[[Exception, int], None] = None,
+    jitter_mode: JitterMode = "full",
 ):
     """
     Decorator for retrying async functions with exponential backoff.
@@ -37,9 +72,10 @@ def with_retry(
         base_delay: Initial delay between retries in seconds
         max_delay: Maximum delay between retries
         backoff_factor: Multiplier for delay after each retry
-        jitter: Add randomness to delay to prevent thundering herd
+        jitter: Randomize delays so clients don't retry in lockstep
         exceptions: Tuple of exception types to catch and retry
         on_retry: Optional callback(exception, attempt_number) called before each retry
+        jitter_mode: "full" (0..delay), "equal" (delay/2..delay) or "none"
     
     Example:
         @with_retry(max_attempts=3, exceptions=(OpenAIError, RateLimitError))
@@ -47,6 +83,13 @@ def with_retry(
             return await openai.chat.completions.create(...)
     """
     def decorator(func):
+        # Backoff schedule is fixed per decoration; index it per retry
+        delays = tuple(
+            min(base_delay * backoff_factor ** i, max_delay)
+            for i in range(max(max_attempts - 1, 0))
+        )
+        apply_jitter = _make_jitter(jitter, jitter_mode)
+        
         @wraps(func)
         async def wrapper(*args, **kwargs):
             last_exception = None
@@ -61,7 +104,7 @@ def with_retry(
                     # Don't retry on last attempt
                     if attempt >= max_attempts:
                         logger.error(
-                            f"All {max_attempts} attempts failed for {func.__name__}",
+                            "All %d attempts failed for %s", max_attempts, func.__name__,
                             extra={
                                 "function": func.__name__,
                                 "attempts": attempt,
@@ -70,25 +113,23 @@ def with_retry(
                         )
                         raise RetryExhausted(e, attempt) from e
                     
-                    # Calculate delay with exponential backoff
-                    delay = min(base_delay * (backoff_factor ** (attempt - 1)), max_delay)
-                    
-                    # Add jitter (±25% randomness)
-                    if jitter:
-                        delay = delay * (0.75 + random.random() * 0.5)
+                    # Exponential backoff, precomputed above, then jittered
+                    delay = apply_jitter(delays[attempt - 1])
                     
                     # Log the retry
-                    logger.warning(
-                        f"Retry {attempt}/{max_attempts} for {func.__name__} after {delay:.1f}s",
-                        extra={
-                            "function": func.__name__,
-                            "attempt": attempt,
-                            "max_attempts": max_attempts,
-                            "delay": round(delay, 2),
-                            "error": str(e),
-                            "error_type": type(e).__name__,
-                        }
-                    )
+                    if logger.isEnabledFor(logging.WARNING):
+                        logger.warning(
+                            "Retry %d/%d for %s after %.1fs",
+                            attempt, max_attempts, func.__name__, delay,
+                            extra={
+                                "function": func.__name__,
+                                "attempt": attempt,
+                                "max_attempts": max_attempts,
+                                "delay": round(delay, 2),
+                                "error": str(e),
+                                "error_type": type(e).__name__,
+                            }
+                        )
                     
                     # Call retry callback if provided
                     if on_retry:
@@ -114,14 +155,19 @@ def with_retry_sync(
     backoff_factor: float = 2.0,
     jitter: bool = True,
     exceptions: Tuple[Type[Exception], ...] = (Exception,),
+    jitter_mode: JitterMode = "full",
 ):
     """
     Synchronous version of retry decorator.
     Use for non-async functions.
     """
-    import time
-    
     def decorator(func):
+        delays = tuple(
+            min(base_delay * backoff_factor ** i, max_delay)
+            for i in range(max(max_attempts - 1, 0))
+        )
+        apply_jitter = _make_jitter(jitter, jitter_mode)
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
             last_exception = None
@@ -136,12 +182,11 @@ def with_retry_sync(
                     if attempt >= max_attempts:
                         raise RetryExhausted(e, attempt) from e
                     
-                    delay = min(base_delay * (backoff_factor ** (attempt - 1)), max_delay)
-                    if jitter:
-                        delay = delay * (0.75 + random.random() * 0.5)
+                    delay = apply_jitter(delays[attempt - 1])
                     
                     logger.warning(
-                        f"Retry {attempt}/{max_attempts} for {func.__name__} after {delay:.1f}s"
+                        "Retry %d/%d for %s after %.1fs",
+                        attempt, max_attempts, func.__name__, delay,
                     )
                     
                     time.sleep(delay)
@@ -152,6 +197,48 @@ def with_retry_sync(
     return decorator
 
 
+class RedisBreakerStore:
+    """
+    Shares OPEN circuit breaker state between workers through Redis.
+    
+    A breaker that trips writes cb:{name}:open with a TTL equal to its
+    open period, so other workers fail fast too instead of each finding
+    the outage on their own. Breakers only re-read the key every
+    cache_ttl seconds, in the background, so Redis is not on the request
+    path. Redis errors are logged and ignored; breakers then act on their
+    local state alone.
+    """
+    
+    def __init__(self, url: str, cache_ttl: float = 1.0, prefix: str = "cb"):
+        if aioredis is None:
+            raise ImportError("redis package is required for RedisBreakerStore")
+        self._redis = aioredis.from_url(url)
+        self.cache_ttl = cache_ttl
+        self.prefix = prefix
+    
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}:open"
+    
+    async def mark_open(self, name: str, seconds: float):
+        """Publish that breaker `name` is open for the next `seconds`."""
+        try:
+            await self._redis.set(self._key(name), 1, px=max(int(seconds * 1000), 1))
+        except Exception as e:
+            logger.warning(f"Could not publish breaker state for {name}: {e}")
+    
+    async def open_for(self, name: str) -> float:
+        """Seconds breaker `name` stays open across workers, 0 if it isn't."""
+        try:
+            ms = await self._redis.pttl(self._key(name))
+        except Exception as e:
+            logger.warning(f"Could not read breaker state for {name}: {e}")
+            return 0.0
+        return ms / 1000 if ms > 0 else 0.0
+    
+    async def close(self):
+        await self._redis.aclose()
+
+
 class CircuitBreaker:
     """
     Circuit breaker pattern to prevent cascading failures.
@@ -161,6 +248,19 @@ class CircuitBreaker:
     - OPEN: Too many failures, requests fail immediately
     - HALF_OPEN: Testing if service recovered
     
+    The time spent OPEN before probing starts at initial_recovery_timeout
+    and doubles every time a probe fails, up to recovery_timeout. A short
+    blip is therefore retried quickly while a real outage backs off.
+    
+    With recovery_ramp > 0, a breaker that has just closed admits half of
+    requests at first, growing with each success until recovery_ramp
+    successes have gone through, so a service that only just recovered
+    isn't hit with full traffic at once.
+    
+    With a store (see RedisBreakerStore), tripping also tells the other
+    workers, and a closed breaker refuses requests while another worker
+    reports the same dependency open.
+    
     Example:
         breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=30)
         
@@ -185,37 +285,124 @@ class CircuitBreaker:
         failure_threshold: int = 5,
         recovery_timeout: float = 30.0,
         half_open_max_calls: int = 3,
+        initial_recovery_timeout: float = None,
+        name: str = "default",
+        store: Optional[RedisBreakerStore] = None,
+        recovery_ramp: int = 0,
     ):
+        self.name = name
+        self.store = store
+        self.recovery_ramp = recovery_ramp
         self.failure_threshold = failure_threshold
         self.recovery_timeout = recovery_timeout
         self.half_open_max_calls = half_open_max_calls
+        self.initial_recovery_timeout = min(
+            initial_recovery_timeout or recovery_timeout, recovery_timeout
+        )
         
         self._state = self.CLOSED
         self._failure_count = 0
         self._success_count = 0
         self._last_failure_time = 0
         self._half_open_calls = 0
+        self._open_timeout = self.initial_recovery_timeout
+        self._ramp_remaining = 0  # successes left before full traffic
+        self._rng = random.Random()
+        
+        # Shared state, refreshed from the store at most every cache_ttl
+        self._shared_open_until = 0.0
+        self._shared_checked_until = 0.0
+        self._refreshing = False
+        self._tasks = set()
+    
+    # -- shared state -----------------------------------------------
+    
+    def _spawn(self, coro):
+        """Run a store call in the background; skipped outside a loop."""
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _refresh_shared(self):
+        self._refreshing = True
+        try:
+            remaining = await self.store.open_for(self.name)
+            self._shared_open_until = _monotonic() + remaining if remaining else 0.0
+        finally:
+            self._refreshing = False
+    
+    def _shared_allows(self) -> bool:
+        """Whether other workers currently report this dependency healthy."""
+        now = _monotonic()
+        if now >= self._shared_checked_until and not self._refreshing:
+            self._shared_checked_until = now + self.store.cache_ttl
+            self._spawn(self._refresh_shared())
+        return now >= self._shared_open_until
+    
+    # -- transitions ------------------------------------------------
+    # Every state change goes through one of these, and each one resets
+    # exactly the counters that belong to the state it enters.
+    
+    def _trip(self):
+        """CLOSED/HALF_OPEN -> OPEN."""
+        self._state = self.OPEN
+        self._success_count = 0
+        self._ramp_remaining = 0
+        if self.store is not None:
+            self._spawn(self.store.mark_open(self.name, self._open_timeout))
+    
+    def _try_probe(self) -> bool:
+        """OPEN -> HALF_OPEN once the open period has elapsed."""
+        if _monotonic() - self._last_failure_time < self._open_timeout:
+            return False
+        self._state = self.HALF_OPEN
+        self._half_open_calls = 0
+        logger.info("Circuit breaker transitioning to HALF_OPEN")
+        return True
+    
+    def _close(self, ramp: bool = True):
+        """Any state -> CLOSED, with backoff back at its start."""
+        self._state = self.CLOSED
+        self._failure_count = 0
+        self._success_count = 0
+        self._half_open_calls = 0
+        self._open_timeout = self.initial_recovery_timeout
+        self._ramp_remaining = self.recovery_ramp if ramp else 0
+    
+    def _ramp_allows(self) -> bool:
+        """
+        Admit a growing share of requests while ramping back up: half of
+        them right after closing, rising linearly to all. A refused
+        request is an error for its caller, so the ramp can't start low.
+        """
+        admit = 1 - 0.5 * self._ramp_remaining / self.recovery_ramp
+        return self._rng.random() < admit
+    
+    # -- public API -------------------------------------------------
     
     @property
     def state(self) -> str:
         # Check if we should transition from OPEN to HALF_OPEN
         if self._state == self.OPEN:
-            import time
-            if time.time() - self._last_failure_time >= self.recovery_timeout:
-                self._state = self.HALF_OPEN
-                self._half_open_calls = 0
-                logger.info("Circuit breaker transitioning to HALF_OPEN")
+            self._try_probe()
         
         return self._state
     
     def allow_request(self) -> bool:
         """Check if a request should be allowed through."""
-        state = self.state
+        state = self._state
         
+        # Normal operation never needs the clock unless state is shared
         if state == self.CLOSED:
-            return True
+            if self._ramp_remaining and not self._ramp_allows():
+                return False
+            return self.store is None or self._shared_allows()
         
-        if state == self.OPEN:
+        if state == self.OPEN and not self._try_probe():
             return False
         
         # HALF_OPEN: allow limited requests
@@ -225,36 +412,44 @@ class CircuitBreaker:
         
         return False
     
+    def release_probe(self):
+        """
+        Give back a request allow_request() admitted that never reached the
+        dependency (e.g. no bulkhead slot), so it counts neither way.
+        """
+        if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+    
     def record_success(self):
         """Record a successful request."""
         if self._state == self.HALF_OPEN:
             self._success_count += 1
             if self._success_count >= self.half_open_max_calls:
-                self._state = self.CLOSED
-                self._failure_count = 0
-                self._success_count = 0
+                self._close()
                 logger.info("Circuit breaker CLOSED - service recovered")
         
         elif self._state == self.CLOSED:
             # Reset failure count on success
             self._failure_count = 0
+            if self._ramp_remaining:
+                self._ramp_remaining -= 1
     
     def record_failure(self):
         """Record a failed request."""
-        import time
-        
         self._failure_count += 1
-        self._last_failure_time = time.time()
+        self._last_failure_time = _monotonic()
         
         if self._state == self.HALF_OPEN:
-            # Any failure in half-open goes back to open
-            self._state = self.OPEN
-            self._success_count = 0
-            logger.warning("Circuit breaker OPEN - failure in half-open state")
+            # Any failure in half-open goes back to open, for longer
+            self._open_timeout = min(self._open_timeout * 2, self.recovery_timeout)
+            self._trip()
+            logger.warning(
+                f"Circuit breaker OPEN - failure in half-open state, next probe in {self._open_timeout:.1f}s"
+            )
         
         elif self._state == self.CLOSED:
             if self._failure_count >= self.failure_threshold:
-                self._state = self.OPEN
+                self._trip()
                 logger.warning(
                     f"Circuit breaker OPEN - {self._failure_count} failures",
                     extra={"failures": self._failure_count}
@@ -262,8 +457,57 @@ class CircuitBreaker:
     
     def reset(self):
         """Manually reset the circuit breaker."""
-        self._state = self.CLOSED
-        self._failure_count = 0
-        self._success_count = 0
-        self._half_open_calls = 0
-        logger.info("Circuit breaker manually reset")
\ No newline at end of file
+        self._close(ramp=False)
+        logger.info("Circuit breaker manually reset")
+
+
+class BulkheadFull(Exception):
+    """Raised when a bulkhead has no free slot within its wait time."""
+    pass
+
+
+class Bulkhead:
+    """
+    Cap concurrent calls to one dependency so a surge on it can't starve
+    the others. Callers that can't get a slot within acquire_timeout are
+    rejected instead of queueing indefinitely.
+    
+    Usage:
+        async with bulkhead.slot():
+            await client.call()
+    """
+    
+    def __init__(self, name: str, max_concurrent: int, acquire_timeout: float = 0.5):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.acquire_timeout = acquire_timeout
+        self._sem = asyncio.Semaphore(max_concurrent)
+        self._in_flight = 0
+    
+    @property
+    def in_flight(self) -> int:
+        """Number of slots currently held."""
+        return self._in_flight
+    
+    async def acquire(self):
+        """Take a slot, raising BulkheadFull if none frees up in time."""
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Bulkhead full for {self.name} ({self.max_concurrent} in flight)")
+            raise BulkheadFull(f"{self.name} is at capacity")
+        self._in_flight += 1
+    
+    def release(self):
+        """Give back a slot taken with acquire()."""
+        self._in_flight -= 1
+        self._sem.release()
+    
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a slot for the duration of the block."""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
@@ -470,19 +470,18 @@ async function sendMessage(text, fromVoice = false) {
   appendThinking();
   
   try {
-    const response = await fetch('/v1/chat', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ messages: chatHistory })
-    });
+    const assistantContent = (await streamReply()) || 'Sorry, I encountered an error.';
     
-    const data = await response.json();
-    const assistantContent = data.message?.content || 'Sorry, I encountered an error.';
-    
-    // Remove thinking, add response
+    // Replace whatever was streamed with the final reply
     removeThinking();
+    const streamed = $('#streaming-bubble');
+    if (streamed) {
+      streamed.removeAttribute('id');
+      streamed.querySelector('.message-bubble').innerHTML = linkify(assistantContent);
+    } else {
+      appendMessage('assistant', assistantContent);
+    }
     chatHistory.push({ role: 'assistant', content: assistantContent });
-    appendMessage('assistant', assistantContent);
     
     // Save chat
     saveCurrentChat();
@@ -496,10 +495,67 @@ async function sendMessage(text, fromVoice = false) {
   } catch (error) {
     console.error('Chat error:', error);
     removeThinking();
+    $('#streaming-bubble')?.remove();
     appendMessage('assistant', 'Sorry, something went wrong. Please try again.');
   }
 }
 
+// Read the reply from /v1/chat/stream, rendering text as it arrives so the
+// first words show up without waiting for the whole completion.
+// Resolves to the final assistant content.
+async function streamReply() {
+  const response = await fetch('/v1/chat/stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ messages: chatHistory })
+  });
+  
+  if (!response.ok || !response.body) {
+    const data = await response.json().catch(() => ({}));
+    return data.message?.content || '';
+  }
+  
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let content = '';
+  let bubble = null;
+  
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    
+    // Events are separated by a blank line; keep any partial one
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    
+    for (const raw of events) {
+      if (!raw.startsWith('data: ')) continue;
+      const event = JSON.parse(raw.slice(6));
+      
+      if (event.error) {
+        throw new Error(event.message || event.error);
+      }
+      if (event.done) {
+        return event.message?.content || content;
+      }
+      if (event.delta) {
+        content += event.delta;
+        if (!bubble) {
+          removeThinking();
+          bubble = appendMessage('assistant', '');
+          bubble.id = 'streaming-bubble';
+        }
+        bubble.querySelector('.message-bubble').innerHTML = linkify(content);
+        scrollToBottom();
+      }
+    }
+  }
+  
+  return content;
+}
+
 // =====================================================
 // TEXT TO SPEECH
 // =====================================================
@@ -1,9 +1,15 @@
 import os
 import re
-from typing import Optional, Dict, Any, List
+import asyncio
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
+from types import MappingProxyType
 from zoneinfo import ZoneInfo
 
+from logging_config import get_logger
+
+logger = get_logger("mogul.tools")
+
 # --- Firestore (optional; won't crash if creds are missing) ---
 import firebase_admin
 from firebase_admin import credentials, firestore
@@ -15,15 +21,18 @@ except ValueError:
     try:
         cred = credentials.ApplicationDefault()
         firebase_admin.initialize_app(cred)
-    except Exception:
+    except Exception as e:
         # If creds aren't available, we'll just run with db = None
-        pass
+        logger.debug(f"firebase_admin init skipped: {e}")
 
 try:
     db = firestore.client()
-except Exception:
+except Exception as e:
+    logger.warning(f"Customer tools running without Firestore: {e}")
     db = None
 
+CUSTOMERS = db.collection("customers") if db else None
+
 
 # ---------------------------------------------------------------------------------
 # Helpers
@@ -31,14 +40,25 @@ except Exception:
 
 DEFAULT_TZ = os.getenv("DEFAULT_TZ", "America/New_York")
 
-EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+_EMAIL_OK = EMAIL_RE.fullmatch
 
 
 def _is_valid_email(email: str) -> bool:
     """Basic sanity check. Assistant should do this before saving."""
     if not email:
         return False
-    return EMAIL_RE.match(email.strip()) is not None
+    return _EMAIL_OK(email.strip()) is not None
+
+
+class _AsciiDigitsOnly(dict):
+    """str.translate table that deletes every character except 0-9."""
+
+    def __missing__(self, key):
+        return None
+
+
+_KEEP_DIGITS = _AsciiDigitsOnly({ord(c): c for c in "0123456789"})
 
 
 def _clean_phone(phone: str) -> str:
@@ -48,7 +68,7 @@ def _clean_phone(phone: str) -> str:
     """
     if not phone:
         return ""
-    digits = re.sub(r"\D", "", phone)
+    digits = phone.translate(_KEEP_DIGITS)
     if not digits:
         return ""
     # If it's 10 digits, assume US +1
@@ -60,15 +80,52 @@ def _clean_phone(phone: str) -> str:
     return digits
 
 
+_DEFAULT_ZONE = ZoneInfo(DEFAULT_TZ)
+
+
 def _now_iso(tz: str = DEFAULT_TZ) -> str:
     """Return ISO timestamp in your local/business timezone for logging."""
-    return datetime.now(ZoneInfo(tz)).isoformat()
+    zone = _DEFAULT_ZONE if tz == DEFAULT_TZ else ZoneInfo(tz)
+    return datetime.now(zone).isoformat()
+
+
+def customer_lookup_key(email: Optional[str], phone: Optional[str]) -> Tuple[str, str]:
+    """
+    The (email, phone) pair lookup_customer actually queries with, for
+    caching: spellings of the same number or address share one key.
+    """
+    return ((email or "").strip().lower(), _clean_phone(phone))
+
+
+def _find_customer(field: str, value: str) -> Optional[Dict[str, Any]]:
+    """
+    First customer whose `field` equals `value`, or None.
+    Blocking Firestore query; call it through asyncio.to_thread.
+    """
+    q = (
+        CUSTOMERS
+          .where(field, "==", value)
+          .limit(1)
+          .stream()
+    )
+    for doc in q:
+        data = doc.to_dict()
+        data["id"] = doc.id
+        return data
+    return None
 
 
 # ---------------------------------------------------------------------------------
 # TOOL: get_booking_link
 # ---------------------------------------------------------------------------------
 
+# Read-only: it is shared by every request; the tool hands out copies
+BOOKING_LINK = MappingProxyType({
+    "url": "https://cal.com/jordan-c-cmbf7z/30min?overlayCalendar=true",
+    "label": "Book a 30-minute call"
+})
+
+
 async def get_booking_link() -> Dict[str, str]:
     """
     ALWAYS-SAFE TOOL.
@@ -78,10 +135,7 @@ async def get_booking_link() -> Dict[str, str]:
     We do NOT try to auto-book.
     We simply return the public Cal.com link.
     """
-    return {
-        "url": "https://cal.com/jordan-c-cmbf7z/30min?overlayCalendar=true",
-        "label": "Book a 30-minute call"
-    }
+    return dict(BOOKING_LINK)
 
 
 # ---------------------------------------------------------------------------------
@@ -108,18 +162,17 @@ async def lookup_customer(
     clean_email = email.strip().lower() if email else None
     clean_phone = _clean_phone(phone) if phone else None
 
+    # A malformed email can't match a stored customer; don't spend a query on it
+    if clean_email and not _EMAIL_OK(clean_email):
+        clean_email = None
+
+    # The Firestore client is synchronous; queries run in a worker thread
+    # so they don't stall the event loop.
     try:
         # Try matching on email first
         if clean_email:
-            q = (
-                db.collection("customers")
-                  .where("email", "==", clean_email)
-                  .limit(1)
-                  .stream()
-            )
-            for doc in q:
-                data = doc.to_dict()
-                data["id"] = doc.id
+            data = await asyncio.to_thread(_find_customer, "email", clean_email)
+            if data is not None:
                 return {
                     "ok": True,
                     "reason": "match_email",
@@ -128,15 +181,8 @@ async def lookup_customer(
 
         # Then phone
         if clean_phone:
-            q = (
-                db.collection("customers")
-                  .where("phone", "==", clean_phone)
-                  .limit(1)
-                  .stream()
-            )
-            for doc in q:
-                data = doc.to_dict()
-                data["id"] = doc.id
+            data = await asyncio.to_thread(_find_customer, "phone", clean_phone)
+            if data is not None:
                 return {
                     "ok": True,
                     "reason": "match_phone",
@@ -144,6 +190,7 @@ async def lookup_customer(
                 }
 
     except Exception as e:
+        logger.warning(f"lookup_customer failed: {e}")
         return {
             "ok": False,
             "reason": f"firestore_error:{e}",
@@ -187,13 +234,9 @@ async def add_note(
     }
 
     try:
-        notes_ref = (
-            db.collection("customers")
-              .document(customer_id)
-              .collection("notes")
-        )
+        notes_ref = CUSTOMERS.document(customer_id).collection("notes")
         new_ref = notes_ref.document()
-        new_ref.set(note_doc)
+        await asyncio.to_thread(new_ref.set, note_doc)
 
         return {
             "ok": True,
@@ -202,6 +245,7 @@ async def add_note(
         }
 
     except Exception as e:
+        logger.warning(f"add_note failed: {e}")
         return {
             "ok": False,
             "reason": f"firestore_error:{e}",
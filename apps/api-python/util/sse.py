@@ -1,7 +1,7 @@
 from typing import AsyncGenerator
 
-# Reserved for future streaming (SSE) helpers.
-# For now, the /v1/chat endpoint returns JSON non-streaming.
+# Server-Sent Events helpers.
+# Used by /v1/chat/stream; /v1/chat still returns non-streaming JSON.
 
 async def sse_event_stream(gen) -> AsyncGenerator[str, None]:
     async for chunk in gen:
@@ -4,4 +4,6 @@ cd "$(dirname "$0")/../apps/api-python"
 python3 -m venv .venv
 source .venv/bin/activate
 pip install -r requirements.txt
-uvicorn main:app --reload --port 8787
+# The app lives in api/index.py and imports the modules in apps/api-python
+cd ../..
+PYTHONPATH=apps/api-python uvicorn api.index:app --reload --port 8787 --loop uvloop --http httptools
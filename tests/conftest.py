@@ -0,0 +1,19 @@
+"""
+Shared test setup: make the service modules importable the same way the
+app does (PYTHONPATH=apps/api-python) and give the app the settings it
+requires at import time.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "apps" / "api-python"))
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+# Import the app before any test module imports a service module directly:
+# in production api.index is always the first to initialize Firebase.
+import api.index  # noqa: E402,F401
@@ -0,0 +1,17 @@
+"""Smoke tests for the FastAPI entry point."""
+
+import importlib
+
+
+def test_app_imports():
+    module = importlib.import_module("api.index")
+    assert module.app is not None
+
+
+def test_batch_routes_require_authentication():
+    from fastapi.testclient import TestClient
+    from api.index import app
+
+    client = TestClient(app)
+    assert client.get("/v1/chat/batch/batch_abc").status_code == 401
+    assert client.post("/v1/chat/batch", content=b"{}").status_code == 401
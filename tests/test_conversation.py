@@ -0,0 +1,109 @@
+"""Tests for token counting and history trimming."""
+
+import importlib
+
+import pytest
+
+
+def test_unloadable_tiktoken_encoder_falls_back_to_estimates(monkeypatch):
+    tiktoken = pytest.importorskip("tiktoken")
+
+    def offline(*args, **kwargs):
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", offline)
+    monkeypatch.setattr(tiktoken, "get_encoding", offline)
+
+    import conversation
+    conversation = importlib.reload(conversation)
+    try:
+        assert conversation.estimate_tokens("hello world, how are you") > 0
+        assert len(conversation.estimate_tokens_batch(["a b c"] * 10)) == 10
+    finally:
+        monkeypatch.undo()
+        importlib.reload(conversation)
+
+
+def test_token_cache_is_safe_across_threads(monkeypatch):
+    import threading
+    import conversation
+
+    monkeypatch.setattr(conversation, "TOKEN_CACHE_SIZE", 8)
+    monkeypatch.setattr(conversation, "_token_cache", {})
+    errors = []
+
+    def fill(prefix):
+        try:
+            for i in range(20_000):
+                conversation._remember_tokens(f"{prefix}-{i}", i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fill, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(conversation._token_cache) <= 8
+
+
+def _tool_call(call_id, arguments="{}"):
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{"id": call_id, "type": "function", "function": {"name": "add_note", "arguments": arguments}}],
+    }
+
+
+def _tool_result(call_id, content="ok"):
+    return {"role": "tool", "tool_call_id": call_id, "content": content}
+
+
+def _assert_no_orphaned_tool_results(messages):
+    open_calls = set()
+    for msg in messages:
+        if msg.get("tool_calls"):
+            open_calls = {tc["id"] for tc in msg["tool_calls"]}
+        elif msg["role"] == "tool":
+            assert msg["tool_call_id"] in open_calls, messages
+        else:
+            open_calls = set()
+
+
+def test_trim_keeps_preserved_tool_results_with_their_call():
+    from conversation import trim_conversation_history
+
+    messages = [
+        {"role": "system", "content": "sys"},
+        {"role": "user", "content": "old " * 2000},
+        _tool_call("a", '{"note": "%s"}' % ("long note " * 100)),
+        _tool_result("a"),
+        _tool_result("a"),
+        {"role": "assistant", "content": "here you go"},
+        {"role": "user", "content": "thanks"},
+    ]
+    # The last four messages start mid-group, and the call alone is over budget
+    trimmed = trim_conversation_history(messages, max_tokens=200, preserve_recent=4)
+
+    _assert_no_orphaned_tool_results(trimmed)
+    assert trimmed[1]["tool_calls"]
+
+
+def test_trim_drops_tool_results_whose_call_did_not_fit():
+    from conversation import trim_conversation_history
+
+    messages = [
+        {"role": "system", "content": "sys"},
+        {"role": "user", "content": "book me in"},
+        _tool_call("a"),
+        _tool_result("a", "x " * 20),
+        {"role": "user", "content": "and another thing " * 10},
+        {"role": "assistant", "content": "sure"},
+        {"role": "user", "content": "thanks"},
+    ]
+    # Budget fits the tool result but not the call before it
+    for budget in range(60, 400, 5):
+        trimmed = trim_conversation_history(messages, max_tokens=budget, preserve_recent=2)
+        _assert_no_orphaned_tool_results(trimmed)
@@ -0,0 +1,19 @@
+"""Tests for input sanitization."""
+
+from guardrails import sanitize_input
+
+
+def test_nul_inside_ansi_sequence_is_stripped():
+    assert sanitize_input("\x1b\x00[31mred") == "red"
+
+
+def test_nul_between_newline_runs_collapses_them():
+    assert sanitize_input("a\n\n\x00\n\n\nb") == "a\n\n\nb"
+
+
+def test_ansi_between_newline_runs_collapses_them():
+    assert sanitize_input("a\n\n\x1b[0m\n\n\nb") == "a\n\n\nb"
+
+
+def test_clean_text_is_unchanged():
+    assert sanitize_input("  hello\n\nworld  ") == "hello\n\nworld"
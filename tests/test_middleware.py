@@ -0,0 +1,28 @@
+"""Tests for the rate limiting middleware."""
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from middleware import RateLimitMiddleware
+
+
+def _client():
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[
+        Route("/v1/chat", ok, methods=["POST"]),
+        Route("/v1/chat/stream", ok, methods=["POST"]),
+    ])
+    return TestClient(RateLimitMiddleware(app), client=("10.0.0.1", 1234))
+
+
+def test_chat_stream_shares_the_chat_limit():
+    client = _client()
+    first = client.post("/v1/chat")
+    second = client.post("/v1/chat/stream")
+
+    assert second.headers["x-ratelimit-limit"] == "30"
+    assert int(second.headers["x-ratelimit-remaining"]) == int(first.headers["x-ratelimit-remaining"]) - 1
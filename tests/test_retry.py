@@ -0,0 +1,35 @@
+"""Tests for the circuit breaker."""
+
+import time
+
+from retry import CircuitBreaker
+
+
+def _half_open_breaker(**kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.01, half_open_max_calls=1, **kwargs)
+    breaker.record_failure()
+    time.sleep(0.02)
+    return breaker
+
+
+def test_released_probe_can_be_retried():
+    breaker = _half_open_breaker()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.release_probe()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_release_probe_is_a_no_op_when_closed():
+    breaker = CircuitBreaker()
+    breaker.release_probe()
+    assert breaker.allow_request()
+
+
+def test_recovery_ramp_starts_at_half_traffic():
+    breaker = CircuitBreaker(recovery_ramp=10)
+    breaker._close()
+    admitted = sum(breaker._ramp_allows() for _ in range(10_000))
+    assert 4_500 < admitted < 5_500
@@ -0,0 +1,22 @@
+"""Tests for the agent tools."""
+
+from tools import customer_lookup_key
+
+
+def test_phone_spellings_share_a_lookup_key():
+    assert customer_lookup_key(None, "+1 (555) 123-4567") == customer_lookup_key(None, "15551234567")
+
+
+def test_email_lookup_key_ignores_case_and_spaces():
+    assert customer_lookup_key(" Sarah@Company.com ", None) == customer_lookup_key("sarah@company.com", None)
+
+
+def test_booking_link_results_cannot_change_the_shared_link():
+    import asyncio
+    from tools import BOOKING_LINK, get_booking_link
+
+    result = asyncio.run(get_booking_link())
+    result["url"] = "https://example.com"
+
+    assert BOOKING_LINK["url"] != "https://example.com"
+    assert asyncio.run(get_booking_link())["url"] == BOOKING_LINK["url"]